@@ -0,0 +1,66 @@
+import argparse
+import time
+
+import numpy as np
+
+from fluctus_dsp import FS, presets, create_filterbank, apply_filterbank, limit_peak
+from fluctus_daemon import HearingAidDaemon
+
+# Compares the timing jitter of the original per-block EQ/limiter path with
+# the live daemon callback, on the same simulated input. The allocation
+# guarantees of the daemon callback are checked in tests/.
+
+def legacy_callback(gains):
+    def callback(indata, outdata):
+        audio = indata[:, 0].copy()
+        processed = apply_filterbank(audio, create_filterbank(FS, gains))
+        processed = limit_peak(processed)
+        outdata[:, 0] = processed
+    return callback
+
+def daemon_callback(preset, blocksize):
+    daemon = HearingAidDaemon(blocksize=blocksize)
+    daemon.load_preset(preset)
+
+    def callback(indata, outdata):
+        daemon.process_live_audio(indata, outdata, len(indata), None, None)
+    return callback
+
+def run(callback, blocks, blocksize, warmup):
+    rng = np.random.default_rng(0)
+    inputs = (0.1 * rng.standard_normal((blocks + warmup, blocksize, 1))).astype(np.float32)
+    outdata = np.zeros((blocksize, 1), dtype=np.float32)
+
+    for i in range(warmup):
+        callback(inputs[i], outdata)
+
+    timings = np.empty(blocks)
+    for i in range(blocks):
+        start = time.perf_counter()
+        callback(inputs[warmup + i], outdata)
+        timings[i] = time.perf_counter() - start
+    return timings * 1e6
+
+def report(name, timings):
+    print(f"{name}:")
+    print(f"  time per block  mean {timings.mean():8.1f} us   p50 {np.percentile(timings, 50):8.1f} us"
+          f"   p99 {np.percentile(timings, 99):8.1f} us   max {timings.max():8.1f} us")
+    print(f"  jitter (std)    {timings.std():8.1f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the timing jitter of the live callback")
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--blocksize", type=int, default=4096)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--preset", default="Presbycusis")
+    args = parser.parse_args()
+
+    legacy = run(legacy_callback(presets[args.preset]), args.blocks, args.blocksize, args.warmup)
+    live = run(daemon_callback(args.preset, args.blocksize), args.blocks, args.blocksize, args.warmup)
+
+    report("Legacy float64 path", legacy)
+    report("Daemon callback (default stages)", live)
+    print(f"Jitter reduction: {legacy.std() / max(live.std(), 1e-9):.1f}x")
+
+if __name__ == "__main__":
+    main()
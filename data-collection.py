@@ -11,6 +11,8 @@ import librosa
 import librosa.display
 from df.enhance import enhance, init_df
 
+from fluctus_dsp import render_presets
+
 st.set_page_config(page_title="Audio Processor", layout="wide")
 st.title("Testing DeepFilterNet + VoiceFixer + EQ")
 st.markdown("Upload a WAV file")
@@ -148,3 +150,123 @@ def create_mel_spectrogram(audio_data, sample_rate, title):
     ax.set_title(title)
     fig.colorbar(img, ax=ax, format="%+2.0f dB", label='Intensity [dB]')
     return fig
+
+def fit_length(audio, length):
+    if len(audio) >= length:
+        return audio[:length]
+    return np.pad(audio, (0, length - len(audio)))
+
+def denoise_with_deepfilternet(audio, sample_rate):
+    audio_48k = safe_resample(audio, orig_sr=sample_rate, target_sr=48000)
+    audio_tensor = torch.tensor(audio_48k, dtype=torch.float32).view(1, -1)
+    with torch.no_grad():
+        enhanced = enhance(st.session_state["model"], st.session_state["df_state"], audio_tensor).squeeze().numpy()
+    return fit_length(safe_resample(enhanced, orig_sr=48000, target_sr=sample_rate), len(audio))
+
+def denoise_with_voicefixer(audio, sample_rate):
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as input_file:
+        input_path = input_file.name
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as output_file:
+        output_path = output_file.name
+    try:
+        sf.write(input_path, audio, sample_rate)
+        st.session_state["voicefixer"].restore(input_path, output_path, 0)
+        enhanced, enhanced_sr = sf.read(output_path)
+    finally:
+        os.unlink(input_path)
+        os.unlink(output_path)
+    if enhanced.ndim > 1:
+        enhanced = enhanced[:, 0]
+    return fit_length(safe_resample(enhanced, orig_sr=enhanced_sr, target_sr=sample_rate), len(audio))
+
+def render_denoise_variants(audio, sample_rate, variants):
+    # Each denoising result is computed once and shared by every preset;
+    # the VoiceFixer variant reuses the DeepFilterNet output. The models run
+    # one after another on the single loaded instance, so this step is
+    # serial; only the preset rendering below uses every core.
+    rendered = {"None": audio}
+    if "DeepFilterNet" in variants or "DeepFilterNet + VoiceFixer" in variants:
+        rendered["DeepFilterNet"] = denoise_with_deepfilternet(audio, sample_rate)
+    if "DeepFilterNet + VoiceFixer" in variants:
+        rendered["DeepFilterNet + VoiceFixer"] = denoise_with_voicefixer(rendered["DeepFilterNet"], sample_rate)
+    if "VoiceFixer" in variants:
+        rendered["VoiceFixer"] = denoise_with_voicefixer(audio, sample_rate)
+    return {name: rendered[name] for name in variants}
+
+def create_comparison_spectrograms(renders, sample_rate, row_titles, column_titles):
+    # One mel spectrogram per render, batched through librosa, plotted on
+    # shared axes and a shared colour scale so the presets line up.
+    S = librosa.feature.melspectrogram(
+        y=renders,
+        sr=sample_rate,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        n_mels=n_mels,
+        fmin=fmin,
+        fmax=fmax
+    )
+    S_dB = librosa.power_to_db(S, ref=np.max(S))
+    n_rows, n_cols = renders.shape[:2]
+    fig, axs = plt.subplots(n_rows, n_cols, figsize=(4 * n_cols, 3 * n_rows),
+                            sharex=True, sharey=True, squeeze=False)
+    for row in range(n_rows):
+        for col in range(n_cols):
+            img = librosa.display.specshow(
+                S_dB[row, col],
+                x_axis='time',
+                y_axis='mel',
+                sr=sample_rate,
+                fmin=fmin,
+                fmax=fmax,
+                hop_length=hop_length,
+                vmin=-80.0,
+                vmax=0.0,
+                ax=axs[row, col]
+            )
+            axs[row, col].set_title(f"{column_titles[col]}\n{row_titles[row]}", fontsize=9)
+    fig.colorbar(img, ax=axs, format="%+2.0f dB", label='Intensity [dB]')
+    return fig
+
+# Every (variant, preset) render is kept for the spectrograms and players,
+# so long uploads are trimmed to keep the comparison in memory.
+MAX_COMPARE_SECONDS = 60
+
+st.markdown("## Preset A/B Comparison")
+uploaded_file = st.file_uploader("Upload a WAV file", type=["wav"])
+compare_presets = st.multiselect(
+    "Presets to compare", list(presets.keys()) + ["Current Sliders"],
+    default=list(presets.keys())
+)
+denoise_options = ["None", "DeepFilterNet"]
+if st.session_state.get("voicefixer_loaded"):
+    denoise_options += ["VoiceFixer", "DeepFilterNet + VoiceFixer"]
+compare_variants = st.multiselect("Denoising variants", denoise_options, default=["None"])
+
+if uploaded_file is not None and st.button("Compare Presets"):
+    if not compare_presets or not compare_variants:
+        st.warning("Select at least one preset and one denoising variant")
+        st.stop()
+
+    audio, sample_rate = sf.read(uploaded_file, dtype="float32", always_2d=True)
+    audio = audio[:, 0]
+    if len(audio) > MAX_COMPARE_SECONDS * sample_rate:
+        st.info(f"Comparing the first {MAX_COMPARE_SECONDS} seconds of the upload")
+        audio = audio[:MAX_COMPARE_SECONDS * sample_rate]
+    gain_matrix = np.array([gains if name == "Current Sliders" else presets[name] for name in compare_presets],
+                           dtype=float)
+
+    with st.spinner("Denoising..."):
+        denoised = render_denoise_variants(audio, sample_rate, compare_variants)
+
+    with st.spinner("Rendering presets..."):
+        variants = np.stack([denoised[variant] for variant in compare_variants])
+        renders = render_presets(variants, sample_rate, gain_matrix)
+
+    st.pyplot(create_comparison_spectrograms(renders, sample_rate, compare_variants, compare_presets))
+
+    for row, variant in enumerate(compare_variants):
+        st.markdown(f"### {variant}")
+        columns = st.columns(len(compare_presets))
+        for col, name in enumerate(compare_presets):
+            columns[col].markdown(f"**{name}**")
+            columns[col].audio(renders[row, col], sample_rate=sample_rate)
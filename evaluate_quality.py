@@ -0,0 +1,253 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.signal as signal
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+
+from fluctus_dsp import FS, frequencies, presets, safe_resample, create_sos, apply_sos, validate_gains
+
+# Bump when a metric changes so stale cache entries are recomputed.
+METRICS_VERSION = 3
+CACHE_DIR = ".fluctus-eval-cache"
+# Each neural worker loads its own models and runs a multi-threaded torch,
+# so with the neural stages on only a few workers share the cores.
+NEURAL_MAX_WORKERS = 2
+
+STOI_FS = 10000
+STOI_FRAME = 256
+STOI_NFFT = 512
+STOI_BANDS = 15
+STOI_SEGMENT = 30
+STOI_BETA_DB = -15.0
+
+def scaled_snr(reference, estimate):
+    # SNR after the least-squares gain on the reference, so overall level
+    # changes from the EQ or limiter do not count as noise.
+    scale = np.dot(estimate, reference) / (np.dot(reference, reference) + 1e-12)
+    target = scale * reference
+    noise = estimate - target
+    return 10 * np.log10(np.sum(target ** 2) / (np.sum(noise ** 2) + 1e-12) + 1e-12)
+
+# Frames more than silence_db below the loudest reference frame are left
+# out, as in the usual segmental SNR, so pauses clipped to floor_db do not
+# drag the mean down. Inputs shorter than one frame give NaN.
+def segmental_snr(reference, estimate, frame=1024, hop=512, floor_db=-10.0, ceil_db=35.0, silence_db=40.0):
+    if len(reference) < frame:
+        return float("nan")
+    scale = np.dot(estimate, reference) / (np.dot(reference, reference) + 1e-12)
+    ref_frames = sliding_window_view(scale * reference, frame)[::hop]
+    err_frames = sliding_window_view(estimate - scale * reference, frame)[::hop]
+    ref_energy = np.sum(ref_frames ** 2, axis=1)
+    active = ref_energy > np.max(ref_energy) * 10 ** (-silence_db / 10)
+    if not np.any(active):
+        return float("nan")
+    snr = 10 * np.log10(ref_energy[active] / (np.sum(err_frames[active] ** 2, axis=1) + 1e-12) + 1e-12)
+    return float(np.mean(np.clip(snr, floor_db, ceil_db)))
+
+def third_octave_matrix(fs, nfft, n_bands, min_freq=150.0):
+    freqs = np.fft.rfftfreq(nfft, 1.0 / fs)
+    centers = min_freq * 2 ** (np.arange(n_bands) / 3)
+    low = centers * 2 ** (-1 / 6)
+    high = centers * 2 ** (1 / 6)
+    return ((freqs[np.newaxis, :] >= low[:, np.newaxis]) & (freqs[np.newaxis, :] < high[:, np.newaxis])).astype(float)
+
+def band_envelopes(audio):
+    _, _, spec = signal.stft(audio, fs=STOI_FS, window="hann", nperseg=STOI_FRAME,
+                             noverlap=STOI_FRAME // 2, nfft=STOI_NFFT, boundary=None, padded=False)
+    bands = third_octave_matrix(STOI_FS, STOI_NFFT, STOI_BANDS)
+    return np.sqrt(bands @ (np.abs(spec) ** 2))
+
+def stoi_style(reference, estimate, fs):
+    # Short-time objective intelligibility following the STOI recipe
+    # (10 kHz, 15 third-octave bands, 384 ms segments, clipping at -15 dB
+    # SDR) without the silent-frame removal step.
+    clean = band_envelopes(safe_resample(reference, fs, STOI_FS))
+    processed = band_envelopes(safe_resample(estimate, fs, STOI_FS))
+    n = min(clean.shape[1], processed.shape[1])
+    if n < STOI_SEGMENT:
+        return float("nan")
+
+    x = sliding_window_view(clean[:, :n], STOI_SEGMENT, axis=1)
+    y = sliding_window_view(processed[:, :n], STOI_SEGMENT, axis=1)
+    norm = np.linalg.norm(x, axis=-1, keepdims=True) / (np.linalg.norm(y, axis=-1, keepdims=True) + 1e-12)
+    y = np.minimum(y * norm, x * (1 + 10 ** (-STOI_BETA_DB / 20)))
+
+    x = x - x.mean(axis=-1, keepdims=True)
+    y = y - y.mean(axis=-1, keepdims=True)
+    corr = np.sum(x * y, axis=-1) / (np.linalg.norm(x, axis=-1) * np.linalg.norm(y, axis=-1) + 1e-12)
+    return float(np.mean(corr))
+
+def band_masks(freqs):
+    centers = np.array(frequencies, dtype=float)
+    return ((freqs[np.newaxis, :] >= centers[:, np.newaxis] * 2 ** (-1 / 6))
+            & (freqs[np.newaxis, :] < centers[:, np.newaxis] * 2 ** (1 / 6)))
+
+def band_level_changes(before, after, fs, nperseg=4096):
+    freqs, p_before = signal.welch(before, fs, nperseg=nperseg)
+    _, p_after = signal.welch(after, fs, nperseg=nperseg)
+    in_band = band_masks(freqs)
+    return 10 * np.log10((in_band @ p_after + 1e-20) / (in_band @ p_before + 1e-20))
+
+def designed_band_gains(gains, fs, nperseg=4096):
+    # The peaking filters overlap, so the level change the EQ is designed to
+    # produce in a band is not the slider value: take the cascade's response
+    # on the same frequency grid and average its power over the same masks.
+    freqs = np.fft.rfftfreq(nperseg, 1.0 / fs)
+    _, h = signal.sosfreqz(create_sos(fs, gains, dtype=np.float64), worN=freqs, fs=fs)
+    in_band = band_masks(freqs)
+    return 10 * np.log10((in_band @ np.abs(h) ** 2 + 1e-20) / (in_band.sum(axis=1) + 1e-20))
+
+def compute_metrics(clean, noisy, processed, fs, gains):
+    n = min(len(clean), len(noisy), len(processed))
+    clean, noisy, processed = clean[:n], noisy[:n], processed[:n]
+    # Denoising is judged against the clean speech through the same EQ.
+    target = apply_sos(clean, create_sos(fs, gains, dtype=np.float64))
+
+    snr_in = scaled_snr(clean, noisy)
+    snr_out = scaled_snr(target, processed)
+    changes = band_level_changes(noisy, processed, fs)
+    errors = changes - designed_band_gains(gains, fs)
+    metrics = {
+        "snr_in": float(snr_in),
+        "snr_out": float(snr_out),
+        "snr_improvement": float(snr_out - snr_in),
+        "segsnr_in": segmental_snr(clean, noisy),
+        "segsnr_out": segmental_snr(target, processed),
+        "stoi_in": stoi_style(clean, noisy, fs),
+        "stoi_out": stoi_style(clean, processed, fs),
+        "band_gain_error_db": float(np.nanmean(np.abs(errors))),
+    }
+    for freq, change in zip(frequencies, changes):
+        metrics[f"band_change_{freq}hz"] = float(change)
+    return metrics
+
+def cache_key(clean_path, noisy_path, settings):
+    digest = hashlib.sha256()
+    for path in (clean_path, noisy_path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    digest.update(str(METRICS_VERSION).encode())
+    return digest.hexdigest()
+
+_daemon = None
+
+def init_worker(settings, torch_threads):
+    global _daemon
+    from fluctus_daemon import HearingAidDaemon
+
+    _daemon = HearingAidDaemon()
+    if settings["deepfilternet"] or settings["voicefixer"]:
+        import torch
+
+        torch.set_num_threads(torch_threads)
+        _daemon.load_models()
+    _daemon.update(settings)
+
+def evaluate_pair(clean_path, noisy_path):
+    clean, fs = sf.read(clean_path, dtype="float64", always_2d=True)
+    noisy, noisy_fs = sf.read(noisy_path, dtype="float64", always_2d=True)
+    if fs != noisy_fs:
+        raise ValueError(f"Sample rate mismatch: {clean_path} ({fs}) vs {noisy_path} ({noisy_fs})")
+    # Pairs are evaluated at the live device rate, like the hearing aid hears them.
+    clean = safe_resample(clean[:, 0], fs, FS)
+    noisy = safe_resample(noisy[:, 0], fs, FS)
+
+    processed = np.asarray(_daemon.process_block(noisy.astype(np.float32)), dtype=np.float64)
+    return compute_metrics(clean, noisy, processed, FS, _daemon.settings["gains"])
+
+def find_pairs(clean_dir, noisy_dir):
+    pairs = []
+    for name in sorted(os.listdir(noisy_dir)):
+        clean_path = os.path.join(clean_dir, name)
+        if name.lower().endswith(".wav") and os.path.exists(clean_path):
+            pairs.append((name, clean_path, os.path.join(noisy_dir, name)))
+        elif name.lower().endswith(".wav"):
+            print(f"Skipping {name}: no clean reference")
+    return pairs
+
+def evaluate_dataset(clean_dir, noisy_dir, settings, workers=None, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    results = {}
+    pending = []
+    for name, clean_path, noisy_path in find_pairs(clean_dir, noisy_dir):
+        key = cache_key(clean_path, noisy_path, settings)
+        cache_path = os.path.join(cache_dir, f"{key}.json")
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                results[name] = json.load(f)
+        else:
+            pending.append((name, clean_path, noisy_path, cache_path))
+
+    cores = os.cpu_count() or 1
+    if workers is None:
+        workers = min(cores, NEURAL_MAX_WORKERS) if settings["deepfilternet"] or settings["voicefixer"] else cores
+    torch_threads = max(cores // workers, 1)
+
+    print(f"{len(results)} cached, {len(pending)} to compute")
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(settings, torch_threads)) as executor:
+            futures = {
+                executor.submit(evaluate_pair, clean_path, noisy_path): (name, cache_path)
+                for name, clean_path, noisy_path, cache_path in pending
+            }
+            for future, (name, cache_path) in futures.items():
+                try:
+                    metrics = future.result()
+                except Exception as e:
+                    print(f"Evaluation error for {name}: {e}")
+                    continue
+                with open(cache_path, "w") as f:
+                    json.dump(metrics, f)
+                results[name] = metrics
+    return dict(sorted(results.items()))
+
+def write_report(results, output_path):
+    if not results:
+        print("No results")
+        return
+    fields = list(next(iter(results.values())).keys())
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file"] + fields)
+        for name, metrics in results.items():
+            writer.writerow([name] + [metrics[field] for field in fields])
+
+    summary = {field: np.nanmean([m[field] for m in results.values()]) for field in fields}
+    print(f"Mean over {len(results)} files:")
+    for field in ("snr_improvement", "segsnr_in", "segsnr_out", "stoi_in", "stoi_out", "band_gain_error_db"):
+        print(f"  {field:20s} {summary[field]:8.3f}")
+    print(f"Per-file results written to {output_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Objective quality metrics over clean/noisy WAV pairs")
+    parser.add_argument("clean_dir")
+    parser.add_argument("noisy_dir", help="Noisy files, matched to clean_dir by file name")
+    parser.add_argument("--preset", default="None (Manual)", choices=list(presets.keys()))
+    parser.add_argument("--gains", type=float, nargs=len(frequencies), help="Custom EQ gains in dB")
+    parser.add_argument("--deepfilternet", action="store_true")
+    parser.add_argument("--voicefixer", action="store_true")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores, or "
+                        f"{NEURAL_MAX_WORKERS} with a neural stage on)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--output", default="quality-report.csv")
+    args = parser.parse_args()
+
+    settings = {
+        "gains": validate_gains(args.gains if args.gains else presets[args.preset]),
+        "deepfilternet": args.deepfilternet,
+        "voicefixer": args.voicefixer,
+    }
+    results = evaluate_dataset(args.clean_dir, args.noisy_dir, settings, args.workers, args.cache_dir)
+    write_report(results, args.output)
+
+if __name__ == "__main__":
+    main()
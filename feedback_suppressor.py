@@ -0,0 +1,199 @@
+import math
+import time
+
+import numpy as np
+import scipy.signal as signal
+
+from fluctus_dsp import FS, rfft_into, sosfilt_inplace
+
+FEEDBACK_BAND = (500.0, 8000.0)
+IDENTITY_SECTION = np.array([1.0, 0.0, 0.0, 1.0, 0.0, 0.0], dtype=np.float32)
+MAX_INTERVAL = 8
+
+# Howling suppression for open fits with high EQ gain. Each block a short
+# windowed FFT of its tail is checked for a dominant, persistent tonal peak;
+# confirmed peaks get an adaptive notch in a fixed bank of biquad slots that
+# is filtered in place with state carried across blocks. Notches are
+# released after a hold time and re-placed if howling returns; each change
+# goes to a second bank that is crossfaded in over the next block, so
+# placing or releasing a notch does not click. The analysis works on
+# preallocated buffers, and budget_us caps its average cost per block: a
+# slow host analyses every few blocks instead of every block.
+class FeedbackSuppressor:
+    def __init__(self, fs=FS, blocksize=4096, max_notches=4, fft_size=1024, threshold_db=20.0,
+                 persist_blocks=3, hold_blocks=100, notch_q=30.0, budget_us=500.0):
+        self.fs = fs
+        self.fft_size = fft_size
+        self.threshold_db = threshold_db
+        self.persist_blocks = persist_blocks
+        self.hold_blocks = hold_blocks
+        self.notch_q = notch_q
+        self.budget_us = budget_us
+
+        self.window = np.hanning(fft_size)
+        freqs = np.fft.rfftfreq(fft_size, 1.0 / fs)
+        self.lo, self.hi = (int(i) for i in np.searchsorted(freqs, FEEDBACK_BAND))
+        self.bin_hz = fs / fft_size
+        # The analysis runs in float64: numpy's float32 rfft, and mixed
+        # float32/float64 ufuncs, still allocate temporaries even with out=.
+        self.frame = np.zeros(fft_size)
+        self.spectrum = np.zeros(fft_size // 2 + 1, dtype=np.complex128)
+        self.power = np.zeros(self.hi - self.lo)
+        self.scratch = np.zeros(self.hi - self.lo)
+        # 0-d outputs for the reductions, which otherwise allocate a
+        # temporary array each.
+        self.peak_bin = np.zeros((), dtype=np.intp)
+        self.total = np.zeros(())
+        self.lobe = np.zeros(())
+
+        self.sos = np.tile(IDENTITY_SECTION, (max_notches, 1))
+        self.zi = np.zeros((1, max_notches, 2), dtype=np.float32)
+        self.target_sos = self.sos.copy()
+        self.target_zi = self.zi.copy()
+        self.faded = np.zeros(blocksize, dtype=np.float32)
+        self.fade_in = np.linspace(0.0, 1.0, blocksize, dtype=np.float32)
+        self.notch_freqs = [None] * max_notches
+        self.notch_ages = [0] * max_notches
+        self.reset()
+
+    def reset(self):
+        self.sos[:] = IDENTITY_SECTION
+        self.zi.fill(0.0)
+        self.fading = False
+        for slot in range(len(self.notch_freqs)):
+            self.notch_freqs[slot] = None
+            self.notch_ages[slot] = 0
+        self.candidate_bin = -1
+        self.candidate_count = 0
+        self.interval = 1
+        self.counter = 0
+        self.analysis_cost_us = 0.0
+        self.last_cost_us = 0.0
+
+    def active_notches(self):
+        return [f for f in self.notch_freqs if f is not None]
+
+    # Changes are collected in the target bank, starting from the live one,
+    # and crossfaded in by the next process() call.
+    def set_section(self, slot, section):
+        if not self.fading:
+            np.copyto(self.target_sos, self.sos)
+            np.copyto(self.target_zi, self.zi)
+            self.fading = True
+        self.target_sos[slot] = section
+        self.target_zi[0, slot] = 0.0
+
+    def release_notch(self, slot):
+        self.set_section(slot, IDENTITY_SECTION)
+        self.notch_freqs[slot] = None
+        self.notch_ages[slot] = 0
+
+    def place_notch(self, freq):
+        for slot, existing in enumerate(self.notch_freqs):
+            if existing is not None and abs(existing - freq) < 0.03 * freq:
+                self.notch_ages[slot] = 0
+                return
+        free = [slot for slot, f in enumerate(self.notch_freqs) if f is None]
+        slot = free[0] if free else int(np.argmax(self.notch_ages))
+        b, a = signal.iirnotch(freq, self.notch_q, fs=self.fs)
+        self.set_section(slot, np.concatenate([b, a]))
+        self.notch_freqs[slot] = freq
+        self.notch_ages[slot] = 0
+
+    def analyze(self, block):
+        if len(block) < self.fft_size:
+            return
+        np.copyto(self.frame, block[-self.fft_size:])
+        np.multiply(self.frame, self.window, out=self.frame)
+        rfft_into(self.frame, self.spectrum)
+        band = self.spectrum[self.lo:self.hi]
+        power = self.power
+        np.square(band.real, out=power)
+        np.square(band.imag, out=self.scratch)
+        np.add(power, self.scratch, out=power)
+        power.argmax(out=self.peak_bin)
+        k = int(self.peak_bin)
+        peak = float(power[k])
+        # Compare against the mean of the band outside the peak's main lobe,
+        # otherwise the window leakage of the howl itself raises the floor.
+        lobe_start = max(k - 2, 0)
+        lobe_stop = min(k + 3, len(power))
+        power[lobe_start:lobe_stop].sum(out=self.lobe)
+        power.sum(out=self.total)
+        floor = (float(self.total) - float(self.lobe)) / max(len(power) - (lobe_stop - lobe_start), 1)
+        peak_to_mean_db = 10 * math.log10(peak / (floor + 1e-20) + 1e-20)
+        if peak_to_mean_db < self.threshold_db:
+            self.candidate_count = 0
+            return
+
+        if abs(k - self.candidate_bin) <= 1:
+            self.candidate_count += 1
+        else:
+            self.candidate_bin = k
+            self.candidate_count = 1
+        if self.candidate_count < self.persist_blocks:
+            return
+
+        # Parabolic interpolation on the log spectrum refines the peak to a
+        # fraction of a bin so the narrow notch lands on the howl.
+        offset = 0.0
+        if 0 < k < len(power) - 1:
+            left = math.log(float(power[k - 1]) + 1e-20)
+            centre = math.log(peak + 1e-20)
+            right = math.log(float(power[k + 1]) + 1e-20)
+            denom = left - 2 * centre + right
+            if denom < 0:
+                offset = 0.5 * (left - right) / denom
+        self.place_notch(float((self.lo + k + offset) * self.bin_hz))
+        self.candidate_count = 0
+
+    def process(self, block):
+        start = time.perf_counter()
+        self.counter += 1
+        analyzed = self.counter >= self.interval
+        if analyzed:
+            self.counter = 0
+            self.analyze(block)
+            self.analysis_cost_us = (time.perf_counter() - start) * 1e6
+
+        has_notch = False
+        for slot, freq in enumerate(self.notch_freqs):
+            if freq is None:
+                continue
+            self.notch_ages[slot] += 1
+            if self.notch_ages[slot] > self.hold_blocks:
+                self.release_notch(slot)
+            else:
+                has_notch = True
+        if self.fading:
+            self.crossfade_banks(block)
+        elif has_notch:
+            sosfilt_inplace(self.sos, block, self.zi)
+
+        # Spread the analysis so its cost averaged over the interval stays
+        # within budget; only analysis blocks update the measurement. The
+        # notch filtering itself always runs.
+        if analyzed:
+            needed = math.ceil(self.analysis_cost_us / self.budget_us)
+            self.interval = min(max(needed, 1), MAX_INTERVAL)
+        self.last_cost_us = (time.perf_counter() - start) * 1e6
+        return block
+
+    # Runs the block through both banks from the same state and ramps from
+    # the old output to the new one; the new bank then becomes the live one.
+    def crossfade_banks(self, block):
+        n = len(block)
+        if n > len(self.faded):
+            self.faded = np.zeros(n, dtype=np.float32)
+        if n != len(self.fade_in):
+            self.fade_in = np.linspace(0.0, 1.0, n, dtype=np.float32)
+        faded = self.faded[:n]
+        np.copyto(faded, block)
+        sosfilt_inplace(self.sos, block, self.zi)
+        sosfilt_inplace(self.target_sos, faded, self.target_zi)
+        np.subtract(faded, block, out=faded)
+        np.multiply(faded, self.fade_in, out=faded)
+        np.add(block, faded, out=block)
+        np.copyto(self.sos, self.target_sos)
+        np.copyto(self.zi, self.target_zi)
+        self.fading = False
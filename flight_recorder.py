@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+HEADER_FIELDS = 4
+HEADER_BYTES = HEADER_FIELDS * 8
+MAGIC = 0x464C5543545553  # "FLUCTUS"
+MAX_PENDING_TRIGGERS = 16
+
+# Ring file layout: int64 header [magic, fs, capacity, write_pos] followed by
+# capacity float32 frames of (input, output).
+class FlightRecorder:
+    def __init__(self, path, fs, minutes, blocksize, dump_dir="recordings",
+                 pre_seconds=8.0, post_seconds=2.0, max_seconds=60.0):
+        blocks = max(1, int(minutes * 60 * fs) // blocksize)
+        self.fs = fs
+        self.blocksize = blocksize
+        self.capacity = blocks * blocksize
+        self.dump_dir = dump_dir
+        self.pre_frames = min(int(pre_seconds * fs), self.capacity // 2)
+        self.post_frames = min(int(post_seconds * fs), self.capacity // 2)
+        self.max_frames = max(min(int(max_seconds * fs), self.capacity), self.pre_frames + self.post_frames)
+
+        # An existing ring with the same layout is continued, so a restart
+        # after a crash keeps the audio leading up to it; anything else is
+        # moved aside rather than overwritten.
+        write_pos = 0
+        if os.path.exists(path):
+            if ring_matches(path, fs, self.capacity):
+                write_pos = int(np.memmap(path, dtype=np.int64, mode="r", shape=(HEADER_FIELDS,))[3])
+            else:
+                root, ext = os.path.splitext(path)
+                old_path = f"{root}-{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+                os.replace(path, old_path)
+                print(f"Flight recorder: moved incompatible ring file to {old_path}")
+        if write_pos == 0:
+            with open(path, "wb") as f:
+                f.truncate(HEADER_BYTES + self.capacity * 2 * 4)
+        self.header = np.memmap(path, dtype=np.int64, mode="r+", shape=(HEADER_FIELDS,))
+        self.header[:] = [MAGIC, fs, self.capacity, write_pos]
+        self.ring = np.memmap(path, dtype=np.float32, mode="r+", offset=HEADER_BYTES,
+                              shape=(self.capacity, 2))
+
+        # Per-slot views are built up front so a full block is recorded with
+        # two copyto calls and no slicing in the callback.
+        self.input_slots = [self.ring[i * blocksize:(i + 1) * blocksize, 0] for i in range(blocks)]
+        self.output_slots = [self.ring[i * blocksize:(i + 1) * blocksize, 1] for i in range(blocks)]
+        self.blocks = blocks
+        self.write_pos = write_pos
+
+        # Triggers are queued in preallocated slots so the audio thread never
+        # allocates; the recorder thread dumps them in order.
+        self.trigger_positions = np.zeros(MAX_PENDING_TRIGGERS, dtype=np.int64)
+        self.trigger_ends = np.zeros(MAX_PENDING_TRIGGERS, dtype=np.int64)
+        self.trigger_merged = np.zeros(MAX_PENDING_TRIGGERS, dtype=np.int64)
+        self.trigger_reasons = [None] * MAX_PENDING_TRIGGERS
+        self.trigger_settings = [None] * MAX_PENDING_TRIGGERS
+        self.trigger_count = 0
+        self.handled = 0
+        self.dump_count = 0
+        self.running = False
+        self.thread = None
+
+    def write(self, audio_in, audio_out):
+        n = audio_in.shape[0]
+        pos = self.write_pos
+        start = pos % self.capacity
+        if n == self.blocksize and start % self.blocksize == 0:
+            slot = start // self.blocksize
+            np.copyto(self.input_slots[slot], audio_in)
+            np.copyto(self.output_slots[slot], audio_out)
+        else:
+            first = min(n, self.capacity - start)
+            self.ring[start:start + first, 0] = audio_in[:first]
+            self.ring[start:start + first, 1] = audio_out[:first]
+            if first < n:
+                self.ring[:n - first, 0] = audio_in[first:]
+                self.ring[:n - first, 1] = audio_out[first:]
+        self.write_pos = pos + n
+        self.header[3] = self.write_pos
+
+    def mark(self, reason, settings=None):
+        # Called from the audio thread: only records the position, the dump
+        # happens on the recorder thread once the post-roll is captured.
+        # A trigger inside the post-roll of the newest pending dump extends
+        # that dump instead, up to max_frames, so a burst of xruns gives one
+        # file. The recorder thread only dumps once write_pos has reached the
+        # end, so an end that is still ahead of write_pos is safe to move.
+        pos = self.write_pos
+        if self.trigger_count > self.handled:
+            last = (self.trigger_count - 1) % MAX_PENDING_TRIGGERS
+            end = pos + self.post_frames
+            length = end - self.trigger_positions[last] + self.pre_frames
+            if pos < self.trigger_ends[last] and length <= self.max_frames:
+                self.trigger_ends[last] = end
+                self.trigger_merged[last] += 1
+                return
+        slot = self.trigger_count % MAX_PENDING_TRIGGERS
+        self.trigger_positions[slot] = pos
+        self.trigger_ends[slot] = pos + self.post_frames
+        self.trigger_merged[slot] = 0
+        self.trigger_reasons[slot] = reason
+        self.trigger_settings[slot] = settings
+        self.trigger_count += 1
+
+    def start(self):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self._watch, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.ring.flush()
+        self.header.flush()
+
+    def _watch(self):
+        while self.running:
+            time.sleep(0.25)
+            self.dump_ready()
+
+    def dump_ready(self):
+        if self.trigger_count - self.handled > MAX_PENDING_TRIGGERS:
+            lost = self.trigger_count - self.handled - MAX_PENDING_TRIGGERS
+            print(f"Flight recorder: {lost} triggers dropped, queue full")
+            self.handled += lost
+        while self.handled < self.trigger_count:
+            slot = self.handled % MAX_PENDING_TRIGGERS
+            end_pos = int(self.trigger_ends[slot])
+            if self.write_pos < end_pos:
+                break
+            merged = int(self.trigger_merged[slot])
+            try:
+                path = self.dump(int(self.trigger_positions[slot]), end_pos, self.trigger_reasons[slot],
+                                 self.trigger_settings[slot])
+                print(f"Flight recorder: saved {path}" + (f" ({merged} later triggers merged)" if merged else ""))
+            except Exception as e:
+                print(f"Flight recorder dump error: {e}")
+            self.handled += 1
+
+    def snapshot(self, end_pos, frames):
+        frames = min(frames, end_pos, self.capacity)
+        start_pos = end_pos - frames
+        start = start_pos % self.capacity
+        first = min(frames, self.capacity - start)
+        return np.concatenate([self.ring[start:start + first], self.ring[:frames - first]])
+
+    # Snippets are written as float WAVs so replay sees exactly the samples
+    # that glitched, with a JSON sidecar holding the settings at trigger time.
+    def dump(self, trigger_pos, end_pos, reason, settings=None):
+        start_pos = max(trigger_pos - self.pre_frames, 0, self.write_pos - self.capacity)
+        frames = end_pos - start_pos
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+        millis = int(now * 1000) % 1000
+        self.dump_count += 1
+        path = os.path.join(self.dump_dir, f"glitch-{stamp}.{millis:03d}-{self.dump_count}-{reason}.wav")
+        sf.write(path, self.snapshot(end_pos, frames), self.fs, subtype="FLOAT")
+        with open(sidecar_path(path), "w") as f:
+            json.dump({
+                "reason": reason,
+                "fs": self.fs,
+                "trigger_seconds": (trigger_pos - start_pos) / self.fs,
+                "settings": settings,
+            }, f, indent=2)
+        return path
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+def ring_matches(path, fs, capacity):
+    if os.path.getsize(path) != HEADER_BYTES + capacity * 2 * 4:
+        return False
+    header = np.memmap(path, dtype=np.int64, mode="r", shape=(HEADER_FIELDS,))
+    return header[0] == MAGIC and header[1] == fs and header[2] == capacity
+
+def open_ring(path):
+    header = np.memmap(path, dtype=np.int64, mode="r", shape=(HEADER_FIELDS,))
+    if header[0] != MAGIC:
+        raise ValueError(f"{path} is not a flight recorder ring file")
+    fs, capacity, write_pos = int(header[1]), int(header[2]), int(header[3])
+    ring = np.memmap(path, dtype=np.float32, mode="r", offset=HEADER_BYTES, shape=(capacity, 2))
+    return ring, fs, capacity, write_pos
+
+def export_ring(path, output_path, seconds=None):
+    ring, fs, capacity, write_pos = open_ring(path)
+    frames = min(write_pos, capacity)
+    if seconds is not None:
+        frames = min(frames, int(seconds * fs))
+    start = (write_pos - frames) % capacity
+    first = min(frames, capacity - start)
+    audio = np.concatenate([ring[start:start + first], ring[:frames - first]])
+    sf.write(output_path, audio, fs, subtype="FLOAT")
+    return output_path
+
+# The settings saved next to a dump are used unless overridden: preset
+# replaces the gains, and deepfilternet/voicefixer replace the stage toggles
+# when not None.
+def replay(path, output_path, preset=None, deepfilternet=None, voicefixer=None):
+    from fluctus_daemon import HearingAidDaemon
+
+    recording, fs = sf.read(path, dtype="float32", always_2d=True)
+    settings = {}
+    if os.path.exists(sidecar_path(path)):
+        with open(sidecar_path(path)) as f:
+            settings = dict(json.load(f).get("settings") or {})
+    if deepfilternet is not None:
+        settings["deepfilternet"] = deepfilternet
+    if voicefixer is not None:
+        settings["voicefixer"] = voicefixer
+
+    daemon = HearingAidDaemon(fs=fs)
+    if settings.get("deepfilternet") or settings.get("voicefixer"):
+        daemon.load_models()
+    daemon.update(settings)
+    if preset is not None:
+        daemon.load_preset(preset)
+
+    processed = daemon.process_block(recording[:, 0])
+    n = min(len(processed), recording.shape[0])
+    sf.write(output_path, np.stack([recording[:n, 0], processed[:n]], axis=1), fs, subtype="FLOAT")
+    return output_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Fluctus flight recorder tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export the ring file to a WAV file")
+    export_parser.add_argument("ring")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--seconds", type=float)
+
+    replay_parser = commands.add_parser("replay", help="Run a recording through the offline pipeline")
+    replay_parser.add_argument("recording")
+    replay_parser.add_argument("output")
+    replay_parser.add_argument("--preset", help="Override the gains saved with the recording")
+    replay_parser.add_argument("--deepfilternet", action=argparse.BooleanOptionalAction,
+                               help="Override the saved DeepFilterNet setting")
+    replay_parser.add_argument("--voicefixer", action=argparse.BooleanOptionalAction,
+                               help="Override the saved VoiceFixer setting")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        print(export_ring(args.ring, args.output, args.seconds))
+    else:
+        print(replay(args.recording, args.output, args.preset, args.deepfilternet, args.voicefixer))
+
+if __name__ == "__main__":
+    main()
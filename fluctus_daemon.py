@@ -0,0 +1,462 @@
+import argparse
+import base64
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import soundfile as sf
+
+from feedback_suppressor import FeedbackSuppressor
+from flight_recorder import FlightRecorder
+from inference_worker import InferenceWorker
+from fluctus_dsp import (
+    FS, SOSFILT_INPLACE, presets, safe_resample, BlockEqualizer, apply_sos,
+    limit_peak, validate_gains, PeakLimiter,
+)
+from vad_gate import ActivityGate
+
+HOST = "127.0.0.1"
+PORT = 8765
+BLOCKSIZE = 4096
+LATENCY = 0.3
+
+STAGES = ("deepfilternet", "voicefixer", "activity_gate", "feedback_suppression")
+
+def encode_audio(audio):
+    return base64.b64encode(np.asarray(audio, dtype=np.float32).tobytes()).decode()
+
+def decode_audio(data):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+class HearingAidDaemon:
+    def __init__(self, fs=FS, blocksize=BLOCKSIZE, latency=LATENCY, recorder=None, inference=None):
+        self.fs = fs
+        self.blocksize = blocksize
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.settings = {
+            "preset": "None (Manual)",
+            "gains": list(presets["None (Manual)"]),
+            "deepfilternet": False,
+            "voicefixer": False,
+            "activity_gate": True,
+            "feedback_suppression": True,
+        }
+        self.equalizer = BlockEqualizer(fs, self.settings["gains"])
+        self.work = np.zeros(blocksize, dtype=np.float32)
+        self.wet = np.zeros(blocksize, dtype=np.float32)
+        self.delayed = np.zeros(blocksize, dtype=np.float32)
+        self.pending = np.zeros(blocksize, dtype=np.float32)
+        self.gate = ActivityGate(fs, blocksize)
+        self.feedback = FeedbackSuppressor(fs, blocksize)
+        self.limiter = PeakLimiter()
+        self.stream = None
+        self.stream_error = None
+        self.model = None
+        self.df_state = None
+        self.voicefixer = None
+        self.recorder = recorder
+        self.inference = inference
+        self.pending_seq = 0
+        self.last_wet = False
+        self.delay_active = False
+
+    # PyTorch and DeepFilterNet are imported only where they are used, so a
+    # daemon running with --isolated-inference never loads them.
+    def load_models(self):
+        from df.enhance import init_df
+
+        self.model, self.df_state, _ = init_df()
+        try:
+            from voicefixer import VoiceFixer
+            self.voicefixer = VoiceFixer()
+        except ImportError:
+            print("VoiceFixer not available")
+            self.voicefixer = None
+
+    # Settings are replaced as whole objects so the audio callback always sees
+    # a consistent snapshot without taking the lock.
+    def update(self, changes):
+        with self.lock:
+            settings = dict(self.settings)
+            if "gains" in changes:
+                settings["gains"] = validate_gains(changes["gains"])
+                settings["preset"] = changes.get("preset", "None (Manual)")
+            for stage in STAGES:
+                if stage in changes:
+                    settings[stage] = bool(changes[stage])
+            if settings["gains"] != self.settings["gains"]:
+                self.equalizer.set_gains(settings["gains"])
+            self.settings = settings
+            return settings
+
+    def load_preset(self, name):
+        if name not in presets:
+            raise ValueError(f"Unknown preset: {name}")
+        return self.update({"gains": presets[name], "preset": name})
+
+    def status(self):
+        return {
+            "settings": self.settings,
+            "presets": presets,
+            "live_active": self.stream is not None and self.stream.active,
+            "stream_error": self.stream_error,
+            "voicefixer_available": self.voicefixer is not None,
+            "recording": self.recorder is not None,
+            "eq_inplace": SOSFILT_INPLACE,
+            "neural_skipped_percent": self.gate.skipped_percent(),
+            "feedback_notches": self.feedback.active_notches(),
+            "feedback_cost_us": self.feedback.last_cost_us,
+            "inference_worker": None if self.inference is None else self.inference.status(),
+            "inference_restarts": 0 if self.inference is None else self.inference.restarts,
+        }
+
+    def mark_glitch(self, reason):
+        if self.recorder is not None:
+            self.recorder.mark(reason, self.settings)
+
+    def process_with_voicefixer(self, audio, settings):
+        if not self.voicefixer or not settings["voicefixer"]:
+            return audio
+
+        try:
+            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as input_file:
+                input_path = input_file.name
+            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as output_file:
+                output_path = output_file.name
+
+            sf.write(input_path, audio, self.fs)
+            self.voicefixer.restore(input_path, output_path, 0)
+            enhanced_audio, _ = sf.read(output_path)
+
+            os.unlink(input_path)
+            os.unlink(output_path)
+
+            return enhanced_audio
+        except Exception as e:
+            print(f"VoiceFixer error: {e}")
+            self.mark_glitch("voicefixer-error")
+            return audio
+
+    def process_with_deepfilternet(self, audio, settings):
+        if self.model is None or not settings["deepfilternet"]:
+            return audio
+
+        try:
+            import torch
+            from df.enhance import enhance
+
+            audio_48k = safe_resample(audio, orig_sr=self.fs, target_sr=48000)
+            audio_tensor = torch.tensor(audio_48k, dtype=torch.float32).view(1, -1)
+            with torch.no_grad():
+                enhanced = enhance(self.model, self.df_state, audio_tensor).squeeze().numpy()
+            enhanced = safe_resample(enhanced, orig_sr=48000, target_sr=self.fs)
+
+            if np.max(np.abs(enhanced)) > 0:
+                orig_max = np.max(np.abs(audio))
+                new_max = np.max(np.abs(enhanced))
+                scale_factor = min(orig_max / new_max, 2.0) if new_max > 0 else 1.0
+                enhanced = enhanced * scale_factor
+
+            return enhanced
+        except Exception as e:
+            print(f"DeepFilterNet error: {e}")
+            self.mark_glitch("deepfilternet-error")
+            return audio
+
+    def process_neural(self, audio, settings):
+        processed = self.process_with_voicefixer(audio, settings)
+        return self.process_with_deepfilternet(processed, settings)
+
+    def process_block(self, audio):
+        settings = self.settings
+        if self.inference is not None and (settings["voicefixer"] or settings["deepfilternet"]):
+            processed = self.inference.process(audio, settings)
+            if processed is None:
+                print("Inference worker unavailable; skipping the neural stages")
+                self.mark_glitch("inference-unavailable")
+                processed = audio
+        else:
+            processed = self.process_neural(audio, settings)
+        try:
+            processed = apply_sos(processed, self.equalizer.sos)
+        except Exception as e:
+            print(f"EQ error: {e}")
+            self.mark_glitch("eq-error")
+        return limit_peak(processed)
+
+    def apply_neural(self, block, settings):
+        enabled = settings["voicefixer"] or settings["deepfilternet"]
+        was_active = is_active = enabled
+        if enabled and settings["activity_gate"]:
+            was_active, is_active = self.gate.update(block)
+        if self.inference is not None:
+            self.inference.report_errors(self.mark_glitch)
+            self.apply_neural_isolated(block, settings, enabled, is_active)
+            return
+        if not was_active and not is_active:
+            return
+
+        frames = len(block)
+        wet = self.wet[:frames]
+        processed = self.process_neural(block.copy(), settings)
+        n_samples = min(len(processed), frames)
+        wet[:n_samples] = processed[:n_samples]
+        wet[n_samples:] = 0.0
+
+        if was_active != is_active:
+            self.gate.crossfade(block, wet, fade_in=is_active)
+        else:
+            np.copyto(block, wet)
+
+    # With the worker process the enhanced block arrives one callback later,
+    # so while a neural stage is enabled the dry path is delayed by one block
+    # too. Whenever the worker has no result (idle gate, restart, overrun)
+    # the delayed dry block goes on to the EQ, and switches between the two
+    # are crossfaded. With both stages off the dry path is not delayed.
+    def apply_neural_isolated(self, block, settings, enabled, is_active):
+        frames = len(block)
+        wet = self.wet[:frames]
+        delayed = self.delayed[:frames]
+        pending = self.pending[:frames]
+
+        if not enabled and not self.delay_active:
+            np.copyto(delayed, block)
+            return
+
+        received = self.inference.receive(wet, self.pending_seq) == frames
+        self.pending_seq = self.inference.submit(block, settings) if is_active else 0
+        np.copyto(pending, block)
+
+        if not self.delay_active:
+            # Adding the delay repeats one block: fade from the live block,
+            # which continues the previous output, to the previous input
+            # block, which the next delayed output continues.
+            np.copyto(block, delayed)
+            np.copyto(delayed, pending)
+            self.gate.crossfade(block, pending, fade_in=False)
+            self.delay_active = True
+            self.last_wet = False
+            return
+
+        if not enabled:
+            # Removing the delay drops one block: fade from the delayed
+            # block (or its enhanced version) back to the live block.
+            self.gate.crossfade(block, wet if received and self.last_wet else delayed, fade_in=False)
+            np.copyto(delayed, pending)
+            self.delay_active = False
+            self.last_wet = False
+            return
+
+        np.copyto(block, delayed)
+        np.copyto(delayed, pending)
+        if received:
+            if not self.last_wet:
+                self.gate.crossfade(block, wet, fade_in=True)
+            elif not is_active:
+                self.gate.crossfade(block, wet, fade_in=False)
+            else:
+                np.copyto(block, wet)
+        self.last_wet = received and is_active
+
+    def process_live_audio(self, indata, outdata, frames, time_info, status):
+        try:
+            if status:
+                if status.input_overflow:
+                    print("Input overflow")
+                if status.output_underflow:
+                    print("Output underflow")
+                self.mark_glitch("xrun")
+
+            if frames > len(self.work):
+                self.work = np.zeros(frames, dtype=np.float32)
+                self.wet = np.zeros(frames, dtype=np.float32)
+                self.delayed = np.zeros(frames, dtype=np.float32)
+                self.pending = np.zeros(frames, dtype=np.float32)
+            block = self.work[:frames]
+            np.copyto(block, indata[:, 0])
+
+            # Only the neural stages and their activity gate allocate; the EQ,
+            # feedback suppressor and limiter work in place on preallocated
+            # buffers.
+            settings = self.settings
+            self.apply_neural(block, settings)
+
+            self.equalizer.process(block)
+            if settings["feedback_suppression"]:
+                self.feedback.process(block)
+            self.limiter.process(block)
+            np.copyto(outdata[:, 0], block)
+
+        except Exception as e:
+            self.stream_error = str(e)
+            print(f"Audio callback error: {e}")
+            outdata.fill(0)
+            self.mark_glitch("callback-error")
+
+        if self.recorder is not None:
+            self.recorder.write(indata[:, 0], outdata[:, 0])
+
+    def start(self):
+        with self.lock:
+            if self.stream is not None:
+                return
+            self.stream_error = None
+            self.equalizer.reset()
+            self.gate.reset()
+            self.feedback.reset()
+            self.delayed.fill(0.0)
+            self.pending_seq = 0
+            self.last_wet = False
+            self.delay_active = False
+            import sounddevice as sd
+
+            stream = sd.Stream(
+                channels=1,
+                samplerate=self.fs,
+                blocksize=self.blocksize,
+                latency=self.latency,
+                dtype='float32',
+                callback=self.process_live_audio
+            )
+            try:
+                stream.start()
+            except Exception:
+                stream.close()
+                raise
+            self.stream = stream
+
+    def stop(self):
+        with self.lock:
+            stream, self.stream = self.stream, None
+        if stream is not None:
+            try:
+                stream.stop()
+                stream.close()
+            except Exception as e:
+                print(f"Error stopping stream: {e}")
+
+    def capture(self, duration):
+        if self.stream is not None:
+            raise RuntimeError("Stop the live hearing aid before capturing")
+        import sounddevice as sd
+
+        audio = sd.rec(int(duration * self.fs), samplerate=self.fs, channels=1, dtype='float32')
+        sd.wait()
+        audio = audio[:, 0]
+        return audio, self.process_block(audio)
+
+class ControlHandler(BaseHTTPRequestHandler):
+    daemon = None
+
+    def send_json(self, payload, code=200):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length == 0:
+            return {}
+        payload = json.loads(self.rfile.read(length))
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        return payload
+
+    def do_GET(self):
+        if self.path == "/status":
+            self.send_json(self.daemon.status())
+        else:
+            self.send_json({"error": f"Unknown endpoint: {self.path}"}, 404)
+
+    def do_POST(self):
+        try:
+            payload = self.read_json()
+            if self.path == "/settings":
+                self.send_json(self.daemon.update(payload))
+            elif self.path == "/preset":
+                self.send_json(self.daemon.load_preset(payload.get("name")))
+            elif self.path == "/start":
+                self.daemon.start()
+                self.send_json(self.daemon.status())
+            elif self.path == "/stop":
+                self.daemon.stop()
+                self.send_json(self.daemon.status())
+            elif self.path == "/capture":
+                audio, processed = self.daemon.capture(float(payload.get("duration", 2.0)))
+                self.send_json({
+                    "fs": self.daemon.fs,
+                    "original": encode_audio(audio),
+                    "processed": encode_audio(processed),
+                })
+            else:
+                self.send_json({"error": f"Unknown endpoint: {self.path}"}, 404)
+        except (ValueError, TypeError, RuntimeError) as e:
+            self.send_json({"error": str(e)}, 400)
+        except Exception as e:
+            print(f"Control API error: {e}")
+            self.send_json({"error": str(e)}, 500)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Fluctus hearing aid daemon")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--blocksize", type=int, default=BLOCKSIZE)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    parser.add_argument("--autostart", action="store_true", help="Start the live stream immediately")
+    parser.add_argument("--record-minutes", type=float, default=0.0,
+                        help="Keep the last N minutes of input/output in a memory-mapped ring file")
+    parser.add_argument("--record-path", default="fluctus-ring.bin")
+    parser.add_argument("--dump-dir", default="recordings")
+    parser.add_argument("--isolated-inference", action="store_true",
+                        help="Run DeepFilterNet/VoiceFixer in a separate worker process")
+    args = parser.parse_args()
+
+    recorder = None
+    if args.record_minutes > 0:
+        recorder = FlightRecorder(args.record_path, FS, args.record_minutes, args.blocksize,
+                                  dump_dir=args.dump_dir)
+        recorder.start()
+
+    inference = None
+    if args.isolated_inference:
+        inference = InferenceWorker(FS, args.blocksize)
+        inference.start()
+
+    if not SOSFILT_INPLACE:
+        print("Warning: scipy's in-place sosfilt kernel is unavailable; the live EQ allocates per block")
+
+    daemon = HearingAidDaemon(blocksize=args.blocksize, latency=args.latency, recorder=recorder,
+                              inference=inference)
+    if inference is None:
+        print("Loading models...")
+        daemon.load_models()
+    if args.autostart:
+        daemon.start()
+
+    ControlHandler.daemon = daemon
+    server = ThreadingHTTPServer((args.host, args.port), ControlHandler)
+    print(f"Fluctus daemon listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.stop()
+        if recorder is not None:
+            recorder.stop()
+        if inference is not None:
+            inference.stop()
+
+if __name__ == "__main__":
+    main()
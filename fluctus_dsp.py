@@ -0,0 +1,183 @@
+import numpy as np
+import scipy.fft
+import scipy.signal as signal
+from scipy.signal import resample_poly
+
+# The allocation-free live EQ relies on the private kernel behind
+# scipy.signal.sosfilt (checked against scipy 1.17.1). Without it the EQ
+# falls back to the public, allocating sosfilt; SOSFILT_INPLACE reports
+# which path is active and is exposed in the daemon's /status.
+try:
+    from scipy.signal._sosfilt import _sosfilt
+except ImportError:
+    _sosfilt = None
+
+SOSFILT_INPLACE = _sosfilt is not None
+
+FS = 44100
+
+frequencies = [31, 62, 125, 250, 500, 1000, 2000, 4000, 8000, 16000]
+
+presets = {
+    "None (Manual)": [0.0] * 10,
+    "Presbycusis": [0, 0, 0, 0, 2, 4, 6, 10, 12, 10],
+    "Low-Frequency Loss": [8, 6, 6, 4, 2, 0, 0, 0, 0, 0],
+    "Noise-Induced Loss": [0, 0, 0, 0, 0, 0, 4, 8, 6, 4],
+    "Conductive Loss": [10] * 10,
+}
+
+GAIN_MIN = -10.0
+GAIN_MAX = 60.0
+
+# numpy >= 2.0 can write FFT results into a preallocated array. Its rfft
+# wrapper still allocates small temporaries for the scale factor on every
+# call, so the pocketfft ufunc it wraps is called directly when available.
+RFFT_HAS_OUT = np.lib.NumpyVersion(np.__version__) >= "2.0.0"
+try:
+    from numpy.fft._pocketfft_umath import rfft_n_even as _rfft_n_even
+except ImportError:
+    _rfft_n_even = None
+_RFFT_SCALE = np.ones(())
+
+def safe_resample(audio, orig_sr, target_sr):
+    if orig_sr == target_sr:
+        return audio
+    gcd_val = np.gcd(orig_sr, target_sr)
+    up = target_sr // gcd_val
+    down = orig_sr // gcd_val
+    return resample_poly(audio, up=up, down=down)
+
+def design_peaking_eq(fs, center_freq, gain_db, Q=1.0):
+    A = 10 ** (gain_db / 40)
+    omega = 2 * np.pi * center_freq / fs
+    alpha = np.sin(omega) / (2 * Q)
+    b0 = 1 + alpha * A
+    b1 = -2 * np.cos(omega)
+    b2 = 1 - alpha * A
+    a0 = 1 + alpha / A
+    a1 = -2 * np.cos(omega)
+    a2 = 1 - alpha / A
+    b = np.array([b0, b1, b2]) / a0
+    a = np.array([a0, a1, a2]) / a0
+    return b, a
+
+def create_filterbank(fs, gains):
+    return [design_peaking_eq(fs, freq, gain) for freq, gain in zip(frequencies, gains)]
+
+def apply_filterbank(audio, filters):
+    filtered = audio.copy()
+    for b, a in filters:
+        filtered = signal.lfilter(b, a, filtered)
+    return filtered
+
+def filterbank_response(sample_rate, gain_matrix, n_fft):
+    # Combined response of the 10 peaking filters for every preset at once,
+    # evaluated on the rfft grid: shape (n_presets, n_fft // 2 + 1).
+    z = np.exp(-1j * 2 * np.pi * np.fft.rfftfreq(n_fft))
+    response = np.ones((len(gain_matrix), len(z)), dtype=np.complex128)
+    for band, freq in enumerate(frequencies):
+        coeffs = [design_peaking_eq(sample_rate, freq, gain) for gain in gain_matrix[:, band]]
+        b = np.array([c[0] for c in coeffs])
+        a = np.array([c[1] for c in coeffs])
+        num = b[:, 0:1] + b[:, 1:2] * z + b[:, 2:3] * z * z
+        den = a[:, 0:1] + a[:, 1:2] * z + a[:, 2:3] * z * z
+        response *= num / den
+    return response
+
+def render_presets(variants, sample_rate, gain_matrix, tail_seconds=0.5, chunk_size=1 << 16):
+    # Every (denoising variant, preset) pair is equalized together in the
+    # frequency domain, with the FFTs spread across all cores. The filter
+    # responses are truncated to tail_seconds of ringing and applied by
+    # overlap-add over fixed-size chunks, so the complex spectra held at any
+    # time are bounded by chunk_size rather than by the upload length.
+    # Returns float32 with shape (n_variants, n_presets, n).
+    n_variants, length = variants.shape
+    taps = int(tail_seconds * sample_rate)
+    n_ir = scipy.fft.next_fast_len(4 * taps, real=True)
+    impulse = scipy.fft.irfft(filterbank_response(sample_rate, gain_matrix, n_ir), n=n_ir, axis=-1)[:, :taps]
+    n_fft = scipy.fft.next_fast_len(chunk_size + taps - 1, real=True)
+    response = scipy.fft.rfft(impulse, n=n_fft, axis=-1)
+
+    rendered = np.zeros((n_variants, len(gain_matrix), length + n_fft), dtype=np.float32)
+    for start in range(0, length, chunk_size):
+        chunk = variants[:, start:start + chunk_size]
+        spectra = scipy.fft.rfft(chunk, n=n_fft, axis=-1, workers=-1)
+        rendered[..., start:start + n_fft] += scipy.fft.irfft(
+            spectra[:, np.newaxis, :] * response[np.newaxis], n=n_fft, axis=-1, workers=-1)
+    rendered = rendered[..., :length]
+    peaks = np.max(np.abs(rendered), axis=-1, keepdims=True)
+    rendered *= np.minimum(1.0, 0.95 / np.maximum(peaks, 1e-12))
+    return rendered
+
+def create_sos(fs, gains, dtype=np.float32):
+    return np.array([np.concatenate([b, a]) for b, a in create_filterbank(fs, gains)], dtype=dtype)
+
+def apply_sos(audio, sos):
+    return signal.sosfilt(sos, np.asarray(audio, dtype=sos.dtype))
+
+def limit_peak(audio, ceiling=0.95):
+    max_amp = np.max(np.abs(audio))
+    if max_amp > ceiling:
+        audio = audio * (ceiling / max_amp)
+    return audio
+
+# In-place version of limit_peak for the live callback. The reductions and
+# the gain go through preallocated 0-d arrays, since numpy otherwise makes a
+# temporary array for each of them.
+class PeakLimiter:
+    def __init__(self, ceiling=0.95):
+        self.ceiling = ceiling
+        self.high = np.zeros((), dtype=np.float32)
+        self.low = np.zeros((), dtype=np.float32)
+        self.gain = np.zeros((), dtype=np.float32)
+
+    def process(self, block):
+        block.max(out=self.high)
+        block.min(out=self.low)
+        max_amp = max(float(self.high), -float(self.low))
+        if max_amp > self.ceiling:
+            self.gain[()] = self.ceiling / max_amp
+            np.multiply(block, self.gain, out=block)
+        return block
+
+def rfft_into(frame, out):
+    if _rfft_n_even is not None and len(frame) % 2 == 0:
+        return _rfft_n_even(frame, _RFFT_SCALE, out=out)
+    if RFFT_HAS_OUT:
+        return np.fft.rfft(frame, out=out)
+    out[:] = np.fft.rfft(frame)
+    return out
+
+# scipy's sosfilt always returns a fresh array, so the in-place kernel it
+# wraps is used directly when available. zi has shape (1, n_sections, 2).
+def sosfilt_inplace(sos, block, zi):
+    if _sosfilt is not None:
+        _sosfilt(sos, block[np.newaxis], zi)
+    else:
+        y, zf = signal.sosfilt(sos, block, zi=zi[0])
+        block[:] = y
+        zi[0] = zf
+    return block
+
+# Real-time EQ: a float32 biquad cascade filtered in place, with the filter
+# state carried across blocks.
+class BlockEqualizer:
+    def __init__(self, fs, gains):
+        self.fs = fs
+        self.sos = create_sos(fs, gains)
+        self.zi = np.zeros((1, len(self.sos), 2), dtype=np.float32)
+
+    def set_gains(self, gains):
+        self.sos = create_sos(self.fs, gains)
+
+    def reset(self):
+        self.zi.fill(0.0)
+
+    def process(self, block):
+        return sosfilt_inplace(self.sos, block, self.zi)
+
+def validate_gains(gains):
+    gains = [float(g) for g in gains]
+    if len(gains) != len(frequencies):
+        raise ValueError(f"Expected {len(frequencies)} gains, got {len(gains)}")
+    return [min(max(g, GAIN_MIN), GAIN_MAX) for g in gains]
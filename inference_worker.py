@@ -0,0 +1,317 @@
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+CONTROL_FIELDS = 8
+CONTROL_BYTES = CONTROL_FIELDS * 8
+(DEEPFILTERNET, VOICEFIXER, STOP, READY, HEARTBEAT_MS, DEEPFILTERNET_ERRORS, VOICEFIXER_ERRORS,
+ GENERATION) = range(8)
+# Stage errors inside the worker are counted in the control block and turned
+# back into flight recorder marks by the audio process.
+STAGE_ERRORS = {"deepfilternet-error": DEEPFILTERNET_ERRORS, "voicefixer-error": VOICEFIXER_ERRORS}
+
+def now_ms():
+    return int(time.monotonic() * 1000)
+
+# Single-producer/single-consumer ring of fixed-size float32 blocks laid out
+# in a shared memory buffer. Each side only advances its own counter, and
+# every block carries a sequence number so late results can be discarded.
+# A read counter ahead of the write counter, left by a reset that raced the
+# reader, reads as empty until the writer catches up.
+class SharedRing:
+    def __init__(self, buf, offset, slots, blocksize):
+        self.slots = slots
+        self.counters = np.ndarray((2,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 16
+        self.seqs = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * slots
+        self.lengths = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * slots
+        self.data = np.ndarray((slots, blocksize), dtype=np.float32, buffer=buf, offset=offset)
+
+    @staticmethod
+    def nbytes(slots, blocksize):
+        return 16 + 16 * slots + 4 * slots * blocksize
+
+    def reset(self):
+        self.counters[:] = 0
+
+    def push(self, block, seq):
+        written, read = self.counters
+        if written - read >= self.slots:
+            return False
+        slot = written % self.slots
+        n = len(block)
+        np.copyto(self.data[slot, :n], block)
+        self.lengths[slot] = n
+        self.seqs[slot] = seq
+        self.counters[0] = written + 1
+        return True
+
+    def peek_seq(self):
+        written, read = self.counters
+        if read >= written:
+            return -1
+        return self.seqs[read % self.slots]
+
+    def pop(self, out):
+        read = self.counters[1]
+        slot = read % self.slots
+        n = self.lengths[slot]
+        np.copyto(out[:n], self.data[slot, :n])
+        self.counters[1] = read + 1
+        return n
+
+    def skip(self):
+        self.counters[1] += 1
+
+def attach(buf, slots, blocksize):
+    control = np.ndarray((CONTROL_FIELDS,), dtype=np.int64, buffer=buf)
+    inputs = SharedRing(buf, CONTROL_BYTES, slots, blocksize)
+    outputs = SharedRing(buf, CONTROL_BYTES + SharedRing.nbytes(slots, blocksize), slots, blocksize)
+    return control, inputs, outputs
+
+# Stands in for the flight recorder of the worker's HearingAidDaemon.
+class ErrorCounter:
+    def __init__(self, control):
+        self.control = control
+
+    def mark(self, reason, settings=None):
+        if reason in STAGE_ERRORS:
+            self.control[STAGE_ERRORS[reason]] += 1
+
+# Default stage loader for the worker: a HearingAidDaemon with the models
+# loaded. Loaders run in the worker process and return the function that
+# processes one block; they must be picklable, so module-level functions.
+def load_daemon_stages(fs, blocksize, recorder):
+    from fluctus_daemon import HearingAidDaemon
+
+    daemon = HearingAidDaemon(fs=fs, blocksize=blocksize, recorder=recorder)
+    daemon.load_models()
+    return daemon.process_neural
+
+def worker_main(shm_name, fs, blocksize, slots, input_ready, load_stages=load_daemon_stages):
+    # Spawned workers share the parent's resource tracker, so attaching here
+    # does not make a crashed worker unlink the parent's segment.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    control, inputs, outputs = attach(shm.buf, slots, blocksize)
+
+    process_neural = load_stages(fs, blocksize, ErrorCounter(control))
+    block = np.zeros(blocksize, dtype=np.float32)
+    out = np.zeros(blocksize, dtype=np.float32)
+    # The audio process can still be in the middle of a push or pop from
+    # the previous worker while the rings are reset here, so the reset is
+    # announced through GENERATION and the audio side drops anything it
+    # started before it.
+    inputs.reset()
+    outputs.reset()
+    control[GENERATION] += 1
+    control[READY] = 1
+
+    while not control[STOP]:
+        control[HEARTBEAT_MS] = now_ms()
+        if not input_ready.acquire(timeout=0.5):
+            continue
+
+        # Only the newest block is worth processing; anything older would
+        # arrive too late for the audio process to use.
+        seq = -1
+        n = 0
+        while inputs.peek_seq() >= 0:
+            seq = inputs.peek_seq()
+            n = inputs.pop(block)
+        if seq < 0:
+            continue
+
+        settings = {"deepfilternet": bool(control[DEEPFILTERNET]), "voicefixer": bool(control[VOICEFIXER])}
+        processed = process_neural(block[:n].copy(), settings)
+        m = min(len(processed), n)
+        out[:m] = processed[:m]
+        out[m:n] = 0.0
+        outputs.push(out[:n], seq)
+
+    del control, inputs, outputs
+    shm.close()
+
+# Runs DeepFilterNet/VoiceFixer in a separate process so PyTorch never
+# shares the interpreter with the audio callback. Audio is exchanged through
+# shared memory rings with a semaphore wake-up, so nothing is pickled per
+# block. A supervisor thread restarts the worker if it dies or stalls;
+# callers fall back to the dry signal whenever is_ready() is False. A worker
+# that keeps failing before it becomes ready (missing models, say) is
+# restarted with exponential backoff and given up on after max_failures.
+class InferenceWorker:
+    def __init__(self, fs, blocksize, slots=4, stale_seconds=10.0, max_failures=5,
+                 backoff_seconds=1.0, max_backoff_seconds=60.0, load_stages=load_daemon_stages):
+        self.fs = fs
+        self.blocksize = blocksize
+        self.slots = slots
+        self.stale_ms = int(stale_seconds * 1000)
+        self.max_failures = max_failures
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.load_stages = load_stages
+        self.ctx = mp.get_context("spawn")
+        self.shm = None
+        self.worker_process = None
+        self.supervisor = None
+        self.available = False
+        self.running = False
+        self.restarts = 0
+        self.failures = 0
+        self.failed = False
+        self.relaunch_at = None
+        self.seq = 0
+        self.generation = 0
+        self.errors_seen = dict.fromkeys(STAGE_ERRORS, 0)
+        self.restarts_seen = 0
+
+    def start(self):
+        size = CONTROL_BYTES + 2 * SharedRing.nbytes(self.slots, self.blocksize)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.control, self.inputs, self.outputs = attach(self.shm.buf, self.slots, self.blocksize)
+        self.input_ready = self.ctx.Semaphore(0)
+        self.running = True
+        self.launch()
+        self.supervisor = threading.Thread(target=self.supervise, daemon=True)
+        self.supervisor.start()
+
+    # The error counters are left alone so they keep counting across restarts.
+    def launch(self):
+        self.control[STOP] = 0
+        self.control[READY] = 0
+        self.control[HEARTBEAT_MS] = 0
+        self.worker_process = self.ctx.Process(
+            target=worker_main,
+            args=(self.shm.name, self.fs, self.blocksize, self.slots, self.input_ready, self.load_stages),
+            daemon=True
+        )
+        self.worker_process.start()
+        self.available = True
+
+    def supervise(self):
+        while self.running:
+            time.sleep(0.5)
+            if not self.running:
+                break
+            if self.relaunch_at is not None:
+                if time.monotonic() >= self.relaunch_at:
+                    self.relaunch_at = None
+                    self.restarts += 1
+                    self.launch()
+                continue
+
+            alive = self.worker_process.is_alive()
+            ready = bool(self.control[READY])
+            stalled = ready and now_ms() - self.control[HEARTBEAT_MS] > self.stale_ms
+            if alive and not stalled:
+                if ready:
+                    self.failures = 0
+                continue
+
+            self.available = False
+            if alive:
+                self.worker_process.kill()
+            self.worker_process.join()
+            if ready:
+                print(f"Inference worker {'stalled' if alive else 'exited'}; restarting")
+                self.restarts += 1
+                self.launch()
+                continue
+
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                print(f"Inference worker failed {self.failures} times before becoming ready; giving up")
+                self.failed = True
+                break
+            delay = self.restart_delay()
+            print(f"Inference worker exited before becoming ready; restarting in {delay:.1f} s")
+            self.relaunch_at = time.monotonic() + delay
+
+    def restart_delay(self):
+        return min(self.backoff_seconds * 2 ** (self.failures - 1), self.max_backoff_seconds)
+
+    def is_ready(self):
+        return self.available and bool(self.control[READY])
+
+    # A sequence number is only valid for the generation of the rings it
+    # was submitted to; a reset during a push or pop also invalidates it.
+    def submit(self, block, settings):
+        if not self.is_ready():
+            return 0
+        generation = int(self.control[GENERATION])
+        self.control[DEEPFILTERNET] = settings["deepfilternet"]
+        self.control[VOICEFIXER] = settings["voicefixer"]
+        self.seq += 1
+        if not self.inputs.push(block, self.seq) or self.control[GENERATION] != generation:
+            return 0
+        self.generation = generation
+        self.input_ready.release()
+        return self.seq
+
+    def receive(self, out, seq):
+        if seq == 0 or not self.is_ready() or self.control[GENERATION] != self.generation:
+            return 0
+        head = self.outputs.peek_seq()
+        while 0 <= head < seq:
+            self.outputs.skip()
+            head = self.outputs.peek_seq()
+        if head != seq:
+            return 0
+        n = self.outputs.pop(out)
+        if self.control[GENERATION] != self.generation:
+            return 0
+        return n
+
+    # Offline use (capture): blocks go through the worker one at a time, as
+    # they would live. Returns None if the worker is not ready or too slow.
+    def process(self, audio, settings, timeout=5.0):
+        out = np.zeros(len(audio), dtype=np.float32)
+        for start in range(0, len(audio), self.blocksize):
+            block = audio[start:start + self.blocksize]
+            seq = self.submit(block, settings)
+            deadline = time.monotonic() + timeout
+            while self.receive(out[start:start + len(block)], seq) != len(block):
+                if seq == 0 or time.monotonic() > deadline:
+                    return None
+                time.sleep(0.001)
+        return out
+
+    # Calls mark once per kind of stage error or restart seen since the
+    # last call.
+    def report_errors(self, mark):
+        for reason, field in STAGE_ERRORS.items():
+            count = int(self.control[field])
+            if count != self.errors_seen[reason]:
+                self.errors_seen[reason] = count
+                mark(reason)
+        if self.restarts != self.restarts_seen:
+            self.restarts_seen = self.restarts
+            mark("inference-restart")
+
+    def status(self):
+        if not self.running:
+            return "stopped"
+        if self.failed:
+            return "failed"
+        return "ready" if self.is_ready() else "starting"
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.available = False
+        if self.supervisor is not None:
+            self.supervisor.join()
+        self.control[STOP] = 1
+        self.input_ready.release()
+        self.worker_process.join(timeout=2.0)
+        if self.worker_process.is_alive():
+            self.worker_process.kill()
+            self.worker_process.join()
+        del self.control, self.inputs, self.outputs
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,187 @@
+import contextlib
+import ctypes
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from fluctus_daemon import HearingAidDaemon
+from fluctus_dsp import FS, SOSFILT_INPLACE
+from flight_recorder import FlightRecorder
+
+BLOCKSIZE = 4096
+WARMUP = 20
+BLOCKS = 100
+
+# Python bookkeeping (views, scalars, bound methods) costs under 2 KB per
+# block; NumPy buffers are counted separately and must not appear at all.
+MAX_BOOKKEEPING_BYTES = BLOCKSIZE
+
+# tracemalloc only keeps live traces, so a NumPy temporary freed within the
+# block never shows up in np.lib.tracemalloc_domain. Every NumPy data buffer
+# comes from the array allocator, so a counting allocator installed through
+# PyDataMem_SetHandler (NEP 49, numpy >= 1.22) catches those as well.
+_libc = ctypes.CDLL(None)
+_libc.malloc.restype = ctypes.c_void_p
+_libc.malloc.argtypes = [ctypes.c_size_t]
+_libc.calloc.restype = ctypes.c_void_p
+_libc.calloc.argtypes = [ctypes.c_size_t, ctypes.c_size_t]
+_libc.realloc.restype = ctypes.c_void_p
+_libc.realloc.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+_libc.free.argtypes = [ctypes.c_void_p]
+
+_MALLOC = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)
+_CALLOC = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t)
+_REALLOC = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)
+_FREE = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)
+SET_HANDLER_INDEX = 304
+
+class _Allocator(ctypes.Structure):
+    _fields_ = [("ctx", ctypes.c_void_p), ("malloc", _MALLOC), ("calloc", _CALLOC),
+                ("realloc", _REALLOC), ("free", _FREE)]
+
+class _Handler(ctypes.Structure):
+    _fields_ = [("name", ctypes.c_char * 127), ("version", ctypes.c_uint8), ("allocator", _Allocator)]
+
+class CountingAllocator:
+    def __init__(self):
+        self.count = 0
+        # The handler struct, callbacks and capsule name must outlive every
+        # array allocated through them, so they are kept on the instance.
+        self.callbacks = (_MALLOC(self.malloc), _CALLOC(self.calloc), _REALLOC(self.realloc), _FREE(self.free))
+        self.handler = _Handler(b"fluctus_counting_allocator", 1, _Allocator(None, *self.callbacks))
+        self.name = ctypes.create_string_buffer(b"mem_handler")
+        new_capsule = ctypes.pythonapi.PyCapsule_New
+        new_capsule.restype = ctypes.py_object
+        new_capsule.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+        self.capsule = new_capsule(ctypes.addressof(self.handler), ctypes.addressof(self.name), None)
+
+        get_pointer = ctypes.pythonapi.PyCapsule_GetPointer
+        get_pointer.restype = ctypes.c_void_p
+        get_pointer.argtypes = [ctypes.py_object, ctypes.c_char_p]
+        api = ctypes.cast(get_pointer(np._core._multiarray_umath._ARRAY_API, None),
+                          ctypes.POINTER(ctypes.c_void_p))
+        self.set_handler = ctypes.PYFUNCTYPE(ctypes.py_object, ctypes.py_object)(api[SET_HANDLER_INDEX])
+
+    def malloc(self, ctx, size):
+        self.count += 1
+        return _libc.malloc(size)
+
+    def calloc(self, ctx, nelem, elsize):
+        self.count += 1
+        return _libc.calloc(nelem, elsize)
+
+    def realloc(self, ctx, ptr, size):
+        self.count += 1
+        return _libc.realloc(ptr, size)
+
+    def free(self, ctx, ptr, size):
+        _libc.free(ptr)
+
+    @contextlib.contextmanager
+    def counting(self):
+        previous = self.set_handler(self.capsule)
+        try:
+            yield
+        finally:
+            self.set_handler(previous)
+
+@pytest.fixture(scope="module")
+def allocator():
+    if np.lib.NumpyVersion(np.__version__) < "2.0.0":
+        pytest.skip("needs numpy >= 2.0 for the allocator hook")
+    allocator = CountingAllocator()
+    with allocator.counting():
+        np.zeros(3)
+    assert np._core.multiarray.get_handler_name() == "default_allocator"
+    assert allocator.count == 1
+    return allocator
+
+def make_input(blocks):
+    rng = np.random.default_rng(0)
+    t = np.arange(blocks * BLOCKSIZE) / FS
+    # Noise plus a steady tone, so the feedback suppressor places a notch
+    # and the notch bank is exercised too.
+    audio = 0.05 * rng.standard_normal(len(t)) + 0.3 * np.sin(2 * np.pi * 2345 * t)
+    return audio.astype(np.float32).reshape(blocks, BLOCKSIZE, 1)
+
+def numpy_traces():
+    domain = tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)
+    return len(tracemalloc.take_snapshot().filter_traces([domain]).traces)
+
+def measure_callback(daemon, allocator):
+    inputs = make_input(WARMUP + BLOCKS)
+    outdata = np.zeros((BLOCKSIZE, 1), dtype=np.float32)
+    for i in range(WARMUP):
+        daemon.process_live_audio(inputs[i], outdata, BLOCKSIZE, None, None)
+
+    numpy_allocations = []
+    peaks = []
+    tracemalloc.start()
+    try:
+        traces_before = numpy_traces()
+        for i in range(WARMUP, WARMUP + BLOCKS):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            count = allocator.count
+            with allocator.counting():
+                daemon.process_live_audio(inputs[i], outdata, BLOCKSIZE, None, None)
+            numpy_allocations.append(allocator.count - count)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        retained = numpy_traces() - traces_before
+    finally:
+        tracemalloc.stop()
+    assert daemon.stream_error is None
+    return numpy_allocations, retained, peaks
+
+def test_eq_uses_inplace_kernel():
+    assert SOSFILT_INPLACE, "scipy.signal._sosfilt._sosfilt is missing; the live EQ allocates per block"
+
+def test_callback_has_no_per_block_allocations(allocator):
+    daemon = HearingAidDaemon(blocksize=BLOCKSIZE)
+    daemon.load_preset("Presbycusis")
+    assert daemon.settings["activity_gate"] and daemon.settings["feedback_suppression"]
+
+    numpy_allocations, retained, peaks = measure_callback(daemon, allocator)
+
+    assert daemon.feedback.active_notches()
+    assert sum(numpy_allocations) == 0, numpy_allocations
+    assert retained == 0
+    assert max(peaks) < MAX_BOOKKEEPING_BYTES, peaks
+
+def test_callback_with_recorder_has_no_per_block_allocations(tmp_path, allocator):
+    recorder = FlightRecorder(str(tmp_path / "ring.bin"), FS, 0.1, BLOCKSIZE, dump_dir=str(tmp_path))
+    daemon = HearingAidDaemon(blocksize=BLOCKSIZE, recorder=recorder)
+    daemon.load_preset("Conductive Loss")
+
+    numpy_allocations, retained, peaks = measure_callback(daemon, allocator)
+
+    assert recorder.write_pos == (WARMUP + BLOCKS) * BLOCKSIZE
+    assert sum(numpy_allocations) == 0, numpy_allocations
+    assert retained == 0
+    assert max(peaks) < MAX_BOOKKEEPING_BYTES, peaks
+
+def test_allocation_check_catches_small_temporaries(allocator):
+    daemon = HearingAidDaemon(blocksize=BLOCKSIZE)
+    process = daemon.feedback.process
+    daemon.feedback.process = lambda block: process(block) + np.zeros(2, dtype=np.float32)[:0].sum()
+
+    numpy_allocations, _, _ = measure_callback(daemon, allocator)
+    assert min(numpy_allocations) > 0
+
+def test_callback_output_is_limited():
+    daemon = HearingAidDaemon(blocksize=BLOCKSIZE)
+    daemon.update({"gains": [60.0] * 10})
+    outdata = np.zeros((BLOCKSIZE, 1), dtype=np.float32)
+    for block in make_input(5):
+        daemon.process_live_audio(block, outdata, BLOCKSIZE, None, None)
+        assert np.max(np.abs(outdata)) <= 0.95 + 1e-6
+
+@pytest.mark.parametrize("frames", [BLOCKSIZE // 2, BLOCKSIZE * 2])
+def test_callback_handles_other_block_sizes(frames):
+    daemon = HearingAidDaemon(blocksize=BLOCKSIZE)
+    indata = make_input(2).reshape(-1, 1)[:frames]
+    outdata = np.zeros((frames, 1), dtype=np.float32)
+    daemon.process_live_audio(indata, outdata, frames, None, None)
+    assert daemon.stream_error is None
+    assert np.all(np.isfinite(outdata))
@@ -0,0 +1,122 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from fluctus_daemon import ControlHandler, HearingAidDaemon
+from fluctus_dsp import GAIN_MAX, GAIN_MIN, frequencies, presets
+
+def test_update_clamps_gains():
+    daemon = HearingAidDaemon()
+    settings = daemon.update({"gains": [-100.0] + [5] * 8 + [100.0]})
+    assert settings["gains"] == [GAIN_MIN] + [5.0] * 8 + [GAIN_MAX]
+    assert settings["preset"] == "None (Manual)"
+
+def test_update_rejects_wrong_number_of_gains():
+    daemon = HearingAidDaemon()
+    before = daemon.settings
+    with pytest.raises(ValueError):
+        daemon.update({"gains": [0.0] * 3})
+    assert daemon.settings is before
+
+def test_update_rejects_non_numeric_gains():
+    daemon = HearingAidDaemon()
+    with pytest.raises(ValueError):
+        daemon.update({"gains": ["loud"] * len(frequencies)})
+
+def test_update_toggles_stages_and_ignores_unknown_keys():
+    daemon = HearingAidDaemon()
+    settings = daemon.update({"deepfilternet": 1, "activity_gate": False, "volume": 11})
+    assert settings["deepfilternet"] is True
+    assert settings["activity_gate"] is False
+    assert "volume" not in settings
+
+def test_update_replaces_settings_snapshot():
+    daemon = HearingAidDaemon()
+    before = daemon.settings
+    daemon.update({"voicefixer": True})
+    assert before["voicefixer"] is False
+    assert daemon.settings["voicefixer"] is True
+
+def test_load_preset():
+    daemon = HearingAidDaemon()
+    settings = daemon.load_preset("Presbycusis")
+    assert settings["preset"] == "Presbycusis"
+    assert settings["gains"] == [float(g) for g in presets["Presbycusis"]]
+
+def test_load_unknown_preset():
+    daemon = HearingAidDaemon()
+    with pytest.raises(ValueError, match="Unknown preset"):
+        daemon.load_preset("Bionic")
+    assert daemon.settings["preset"] == "None (Manual)"
+
+@pytest.fixture(scope="module")
+def control_server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ControlHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def server(control_server):
+    ControlHandler.daemon = HearingAidDaemon()
+    yield control_server
+    ControlHandler.daemon = None
+
+def request(url, path, body=None):
+    data = None if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+    req = urllib.request.Request(url + path, data=data, method="GET" if data is None else "POST",
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_status_route(server):
+    code, status = request(server, "/status")
+    assert code == 200
+    assert status["live_active"] is False
+    assert status["settings"]["preset"] == "None (Manual)"
+    assert status["inference_worker"] is None
+
+def test_settings_route(server):
+    code, settings = request(server, "/settings", {"gains": [3] * 10, "feedback_suppression": False})
+    assert code == 200
+    assert settings["gains"] == [3.0] * 10
+    assert settings["feedback_suppression"] is False
+    assert request(server, "/status")[1]["settings"] == settings
+
+def test_preset_route(server):
+    code, settings = request(server, "/preset", {"name": "Conductive Loss"})
+    assert code == 200
+    assert settings["gains"] == [10.0] * 10
+
+def test_stop_route_when_not_running(server):
+    code, status = request(server, "/stop", {})
+    assert code == 200
+    assert status["live_active"] is False
+
+@pytest.mark.parametrize("path, body", [
+    ("/preset", {"name": "Bionic"}),
+    ("/preset", {}),
+    ("/settings", {"gains": [0.0]}),
+    ("/settings", b"not json"),
+    ("/settings", [1, 2, 3]),
+    ("/capture", {"duration": "long"}),
+])
+def test_bad_requests(server, path, body):
+    code, reply = request(server, path, body)
+    assert code == 400
+    assert reply["error"]
+
+@pytest.mark.parametrize("path, body", [("/nothing", None), ("/nothing", {})])
+def test_unknown_routes(server, path, body):
+    code, reply = request(server, path, body)
+    assert code == 404
+    assert "/nothing" in reply["error"]
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+sf = pytest.importorskip("soundfile")
+
+from evaluate_quality import (band_level_changes, compute_metrics, designed_band_gains, evaluate_dataset,
+                              segmental_snr)
+from fluctus_dsp import FS, presets, create_sos, apply_sos
+
+def noise(seconds, seed=0):
+    return np.random.default_rng(seed).standard_normal(int(seconds * FS)) * 0.05
+
+def test_designed_band_gains_match_filtered_noise():
+    gains = presets["Presbycusis"]
+    x = noise(5)
+    measured = band_level_changes(x, apply_sos(x, create_sos(FS, gains, dtype=np.float64)), FS)
+    np.testing.assert_allclose(designed_band_gains(gains, FS), measured, atol=0.2)
+
+def test_eq_only_processing_has_no_band_gain_error():
+    gains = presets["Noise-Induced Loss"]
+    clean = noise(3, seed=1)
+    noisy = clean + noise(3, seed=2)
+    processed = apply_sos(noisy, create_sos(FS, gains, dtype=np.float64))
+    metrics = compute_metrics(clean, noisy, processed, FS, gains)
+    assert metrics["band_gain_error_db"] < 0.3
+
+def test_segmental_snr_skips_silent_frames():
+    # Two-second bursts with pauses 60 dB down, and an error 10 dB below the
+    # bursts throughout: only the burst frames should count.
+    clean = noise(8, seed=4)
+    pauses = (np.arange(len(clean)) // (2 * FS)) % 2 == 1
+    clean[pauses] *= 1e-3
+    estimate = clean + noise(8, seed=5) * 10 ** (-10 / 20)
+    assert segmental_snr(clean, estimate) == pytest.approx(10.0, abs=1.0)
+    assert segmental_snr(clean, estimate, silence_db=80.0) < 2.0
+
+def test_segmental_snr_is_nan_for_short_input():
+    clean = noise(0.01, seed=6)
+    assert len(clean) < 1024
+    assert np.isnan(segmental_snr(clean, clean))
+    assert np.isnan(segmental_snr(np.zeros(4096), noise(4096 / FS)))
+
+def test_evaluate_dataset_caches_results(tmp_path):
+    clean_dir, noisy_dir, cache_dir = tmp_path / "clean", tmp_path / "noisy", tmp_path / "cache"
+    clean_dir.mkdir()
+    noisy_dir.mkdir()
+    clean = noise(2, seed=3)
+    sf.write(clean_dir / "a.wav", clean, FS)
+    sf.write(noisy_dir / "a.wav", clean + noise(2, seed=4), FS)
+    settings = {"gains": presets["Presbycusis"], "deepfilternet": False, "voicefixer": False}
+
+    first = evaluate_dataset(str(clean_dir), str(noisy_dir), settings, workers=1, cache_dir=str(cache_dir))
+    second = evaluate_dataset(str(clean_dir), str(noisy_dir), settings, workers=1, cache_dir=str(cache_dir))
+    assert list(first) == ["a.wav"]
+    assert first == second
+    assert len(list(cache_dir.iterdir())) == 1
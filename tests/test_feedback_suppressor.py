@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+import scipy.signal as signal
+
+from feedback_suppressor import FeedbackSuppressor
+from fluctus_daemon import HearingAidDaemon
+from fluctus_dsp import FS, frequencies
+
+BLOCKSIZE = 4096
+
+def level_dbfs(block):
+    return 10 * np.log10(np.mean(np.square(block, dtype=np.float64)) + 1e-20)
+
+def run_loop(suppress, blocks=200, loop_gain=1.5, resonance=2500.0):
+    # A narrow acoustic path around the resonance feeds the output back into
+    # the input one block later; with loop gain above 1 it howls.
+    daemon = HearingAidDaemon(blocksize=BLOCKSIZE)
+    daemon.update({"gains": [0.0] * len(frequencies), "feedback_suppression": suppress})
+    path = np.asarray(signal.iirpeak(resonance, 30.0, fs=FS))
+    path_zi = np.zeros(2)
+    rng = np.random.default_rng(0)
+    output = np.zeros((BLOCKSIZE, 1), dtype=np.float32)
+    levels = []
+    notches = set()
+    for _ in range(blocks):
+        leaked, path_zi = signal.lfilter(path[0], path[1], output[:, 0], zi=path_zi)
+        indata = (0.01 * rng.standard_normal(BLOCKSIZE) + loop_gain * leaked).astype(np.float32)[:, None]
+        output = np.zeros((BLOCKSIZE, 1), dtype=np.float32)
+        daemon.process_live_audio(indata, output, BLOCKSIZE, None, None)
+        levels.append(level_dbfs(output[:, 0]))
+        notches.update(daemon.feedback.active_notches())
+    return levels, notches
+
+def test_closed_loop_howl_is_suppressed():
+    levels_off, _ = run_loop(suppress=False)
+    levels_on, notches = run_loop(suppress=True)
+    off = np.mean(levels_off[-100:])
+    on = np.mean(levels_on[-100:])
+    assert off > -10.0
+    assert on < -25.0
+    assert off - on > 15.0
+    assert notches and all(abs(f - 2500.0) < 25.0 for f in notches)
+
+def tone_blocks(freq, blocks, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(blocks * BLOCKSIZE) / FS
+    audio = 0.2 * np.sin(2 * np.pi * freq * t) + 0.01 * rng.standard_normal(len(t))
+    return [audio[i:i + BLOCKSIZE].astype(np.float32) for i in range(0, len(audio), BLOCKSIZE)]
+
+@pytest.mark.parametrize("freq", [612.3, 2345.6, 7654.3])
+def test_notch_lands_on_off_bin_tone(freq):
+    suppressor = FeedbackSuppressor(FS, BLOCKSIZE)
+    for block in tone_blocks(freq, 6):
+        suppressor.process(block)
+    notches = suppressor.active_notches()
+    assert len(notches) == 1
+    assert notches[0] == pytest.approx(freq, abs=2.0)
+
+def test_notch_released_after_hold_blocks():
+    hold = 10
+    suppressor = FeedbackSuppressor(FS, BLOCKSIZE, hold_blocks=hold)
+    placed = None
+    for i, block in enumerate(tone_blocks(1234.5, 10)):
+        suppressor.process(block)
+        if suppressor.active_notches():
+            placed = i
+            break
+    assert placed == suppressor.persist_blocks - 1
+
+    noise = np.random.default_rng(1).standard_normal((hold + 1, BLOCKSIZE)).astype(np.float32)
+    for block in noise[:hold - 1] * 0.01:
+        suppressor.process(block)
+        assert suppressor.active_notches()
+    suppressor.process(noise[hold - 1] * 0.01)
+    assert suppressor.active_notches() == []
+    assert suppressor.notch_freqs == [None] * len(suppressor.notch_freqs)
+
+def test_notch_changes_do_not_click():
+    # A bin-centred cosine, so every block starts at its peak: placing a
+    # notch on it and releasing it again must not step the output by more
+    # than the cosine's own slope.
+    freq = FS / BLOCKSIZE * 200
+    amplitude = 0.5
+    suppressor = FeedbackSuppressor(FS, BLOCKSIZE, threshold_db=200.0)
+    t = np.arange(12 * BLOCKSIZE) / FS
+    audio = (amplitude * np.cos(2 * np.pi * freq * t)).astype(np.float32)
+    out = []
+    for i in range(12):
+        if i == 2:
+            suppressor.place_notch(freq)
+        if i == 7:
+            suppressor.release_notch(0)
+        out.append(suppressor.process(audio[i * BLOCKSIZE:(i + 1) * BLOCKSIZE].copy()))
+    out = np.concatenate(out)
+    smooth_step = 2 * np.pi * freq * amplitude / FS
+    assert np.max(np.abs(np.diff(out))) < 1.1 * smooth_step
@@ -0,0 +1,157 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+sf = pytest.importorskip("soundfile")
+
+from flight_recorder import FlightRecorder, export_ring, replay, sidecar_path
+from fluctus_dsp import FS, presets, create_sos, apply_sos, limit_peak
+
+BLOCKSIZE = 1024
+
+def make_recorder(tmp_path, minutes=0.05, **kwargs):
+    kwargs.setdefault("pre_seconds", 0.1)
+    kwargs.setdefault("post_seconds", 0.05)
+    return FlightRecorder(str(tmp_path / "ring.bin"), FS, minutes, BLOCKSIZE,
+                          dump_dir=str(tmp_path / "dumps"), **kwargs)
+
+def write_ramp(recorder, blocks):
+    # Input sample i carries the value i / 1e6, output its negative, so any
+    # window of the ring can be checked against its absolute position.
+    for _ in range(blocks):
+        values = (recorder.write_pos + np.arange(BLOCKSIZE)) / 1e6
+        recorder.write(values.astype(np.float32), (-values).astype(np.float32))
+
+def dumps(recorder):
+    if not os.path.isdir(recorder.dump_dir):
+        return []
+    return sorted(os.path.join(recorder.dump_dir, name)
+                  for name in os.listdir(recorder.dump_dir) if name.endswith(".wav"))
+
+def test_trigger_dumps_pre_and_post_roll(tmp_path):
+    recorder = make_recorder(tmp_path)
+    os.makedirs(recorder.dump_dir)
+    write_ramp(recorder, 20)
+    trigger = recorder.write_pos
+    settings = {"gains": [1.0] * 10, "deepfilternet": False}
+    recorder.mark("xrun", settings)
+
+    recorder.dump_ready()
+    assert dumps(recorder) == []
+    write_ramp(recorder, 4)
+    recorder.dump_ready()
+
+    [path] = dumps(recorder)
+    assert path.endswith("-xrun.wav")
+    assert sf.info(path).subtype == "FLOAT"
+    audio, fs = sf.read(path, dtype="float32")
+    assert fs == FS
+    expected = np.arange(trigger - recorder.pre_frames, trigger + recorder.post_frames) / 1e6
+    np.testing.assert_array_equal(audio[:, 0], expected.astype(np.float32))
+    np.testing.assert_array_equal(audio[:, 1], -expected.astype(np.float32))
+
+    with open(sidecar_path(path)) as f:
+        sidecar = json.load(f)
+    assert sidecar["reason"] == "xrun"
+    assert sidecar["settings"] == settings
+    assert sidecar["trigger_seconds"] == pytest.approx(recorder.pre_frames / FS)
+
+def test_overlapping_triggers_are_merged(tmp_path):
+    recorder = make_recorder(tmp_path, max_seconds=0.5)
+    os.makedirs(recorder.dump_dir)
+    write_ramp(recorder, 20)
+    first = recorder.write_pos
+    for _ in range(3):
+        recorder.mark("xrun")
+        write_ramp(recorder, 1)
+        recorder.dump_ready()
+    last = recorder.write_pos - BLOCKSIZE
+    write_ramp(recorder, 4)
+    recorder.dump_ready()
+
+    [path] = dumps(recorder)
+    audio, _ = sf.read(path, dtype="float32")
+    assert len(audio) == last + recorder.post_frames - (first - recorder.pre_frames)
+
+def test_sustained_triggers_are_capped(tmp_path):
+    recorder = make_recorder(tmp_path, max_seconds=0.5)
+    os.makedirs(recorder.dump_dir)
+    write_ramp(recorder, 20)
+    for _ in range(60):
+        recorder.mark("xrun")
+        write_ramp(recorder, 1)
+        recorder.dump_ready()
+    write_ramp(recorder, 4)
+    recorder.dump_ready()
+
+    paths = dumps(recorder)
+    assert 2 <= len(paths) <= 4
+    assert all(sf.info(path).frames <= recorder.max_frames for path in paths)
+
+def test_matching_ring_is_continued(tmp_path):
+    recorder = make_recorder(tmp_path)
+    write_ramp(recorder, 5)
+    written = recorder.write_pos
+    recorder.stop()
+    del recorder
+
+    restarted = make_recorder(tmp_path)
+    assert restarted.write_pos == written
+    assert restarted.ring[written - 1, 0] == np.float32((written - 1) / 1e6)
+    assert os.listdir(tmp_path) == ["ring.bin"]
+
+def test_incompatible_ring_is_moved_aside(tmp_path):
+    recorder = make_recorder(tmp_path, minutes=0.05)
+    write_ramp(recorder, 5)
+    recorder.stop()
+    del recorder
+
+    resized = make_recorder(tmp_path, minutes=0.1)
+    assert resized.write_pos == 0
+    moved = [name for name in os.listdir(tmp_path) if name.startswith("ring-")]
+    assert len(moved) == 1
+    assert os.path.getsize(tmp_path / moved[0]) < os.path.getsize(tmp_path / "ring.bin")
+
+def test_export_ring_unwraps(tmp_path):
+    recorder = make_recorder(tmp_path, minutes=0.01)
+    write_ramp(recorder, recorder.blocks + 3)
+    recorder.stop()
+
+    output = str(tmp_path / "export.wav")
+    export_ring(str(tmp_path / "ring.bin"), output)
+    audio, _ = sf.read(output, dtype="float32")
+    end = recorder.write_pos
+    expected = np.arange(end - recorder.capacity, end) / 1e6
+    np.testing.assert_array_equal(audio[:, 0], expected.astype(np.float32))
+
+    export_ring(str(tmp_path / "ring.bin"), output, seconds=BLOCKSIZE / FS)
+    audio, _ = sf.read(output, dtype="float32")
+    np.testing.assert_array_equal(audio[:, 0], expected[-BLOCKSIZE:].astype(np.float32))
+
+def write_recording(tmp_path, settings):
+    path = str(tmp_path / "glitch.wav")
+    audio = 0.1 * np.random.default_rng(0).standard_normal(FS // 2)
+    sf.write(path, np.stack([audio, audio], axis=1), FS, subtype="FLOAT")
+    with open(sidecar_path(path), "w") as f:
+        json.dump({"reason": "xrun", "fs": FS, "trigger_seconds": 0.1, "settings": settings}, f)
+    return path
+
+def test_replay_uses_saved_settings(tmp_path):
+    settings = {"preset": "Conductive Loss", "gains": presets["Conductive Loss"],
+                "deepfilternet": False, "voicefixer": False}
+    path = write_recording(tmp_path, settings)
+    output = replay(path, str(tmp_path / "replay.wav"))
+
+    audio, _ = sf.read(output, dtype="float32")
+    expected = limit_peak(apply_sos(audio[:, 0], create_sos(FS, presets["Conductive Loss"])))
+    np.testing.assert_allclose(audio[:, 1], expected, atol=1e-6)
+
+def test_replay_preset_overrides_saved_gains(tmp_path):
+    settings = {"gains": presets["Conductive Loss"], "deepfilternet": False, "voicefixer": False}
+    path = write_recording(tmp_path, settings)
+    output = replay(path, str(tmp_path / "replay.wav"), preset="None (Manual)")
+
+    audio, _ = sf.read(output, dtype="float32")
+    np.testing.assert_allclose(audio[:, 1], audio[:, 0], atol=1e-5)
@@ -0,0 +1,22 @@
+import numpy as np
+
+from fluctus_dsp import FS, apply_filterbank, create_filterbank, limit_peak, presets, render_presets
+
+def test_render_presets_matches_time_domain_filterbank():
+    rng = np.random.default_rng(0)
+    variants = (0.1 * rng.standard_normal((2, 3 * FS))).astype(np.float32)
+    # Silence at the end lets the filters ring out inside the compared span.
+    variants[:, -FS // 2:] = 0.0
+    names = list(presets)
+    gain_matrix = np.array([presets[name] for name in names], dtype=float)
+
+    # A chunk size that does not divide the input exercises the overlap-add.
+    rendered = render_presets(variants, FS, gain_matrix, chunk_size=20000)
+    assert rendered.shape == (2, len(names), variants.shape[1])
+    assert rendered.dtype == np.float32
+
+    for row, audio in enumerate(variants):
+        for col, name in enumerate(names):
+            expected = limit_peak(apply_filterbank(audio.astype(np.float64), create_filterbank(FS, presets[name])))
+            error = np.max(np.abs(rendered[row, col] - expected))
+            assert error < 1e-5 * np.max(np.abs(expected)), name
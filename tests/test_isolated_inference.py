@@ -0,0 +1,200 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from fluctus_daemon import HearingAidDaemon
+from fluctus_dsp import FS
+from inference_worker import CONTROL_BYTES, GENERATION, ErrorCounter, InferenceWorker, SharedRing, attach
+
+BLOCKSIZE = 512
+
+# Stands in for InferenceWorker in the audio process: every submitted block
+# comes back halved one callback later.
+class EchoInference:
+    def __init__(self):
+        self.seq = 0
+        self.result = None
+
+    def report_errors(self, mark):
+        pass
+
+    def submit(self, block, settings):
+        self.seq += 1
+        self.result = (self.seq, 0.5 * block)
+        return self.seq
+
+    def receive(self, out, seq):
+        if self.result is None or self.result[0] != seq:
+            return 0
+        out[:] = self.result[1]
+        return len(out)
+
+    def process(self, audio, settings):
+        return 0.5 * audio
+
+def run(daemon, blocks, enable_at=None, disable_at=None):
+    # Stages off, so the output is just the input through the limiter.
+    daemon.update({"activity_gate": False, "feedback_suppression": False})
+    outdata = np.zeros((BLOCKSIZE, 1), dtype=np.float32)
+    outputs = []
+    for i, block in enumerate(blocks):
+        if i == enable_at:
+            daemon.update({"deepfilternet": True})
+        if i == disable_at:
+            daemon.update({"deepfilternet": False})
+        daemon.process_live_audio(block.reshape(-1, 1), outdata, BLOCKSIZE, None, None)
+        outputs.append(outdata[:, 0].copy())
+    return outputs
+
+def ramp_blocks(n):
+    signal = (np.arange(n * BLOCKSIZE) % 1000 / 2000.0).astype(np.float32)
+    return signal.reshape(n, BLOCKSIZE)
+
+def test_no_delay_while_neural_stages_are_off():
+    blocks = ramp_blocks(6)
+    outputs = run(HearingAidDaemon(blocksize=BLOCKSIZE, inference=EchoInference()), blocks)
+    for block, output in zip(blocks, outputs):
+        np.testing.assert_allclose(output, block, atol=1e-6)
+
+def test_delay_follows_the_neural_stages():
+    blocks = ramp_blocks(10)
+    daemon = HearingAidDaemon(blocksize=BLOCKSIZE, inference=EchoInference())
+    outputs = run(daemon, blocks, enable_at=2, disable_at=7)
+
+    np.testing.assert_allclose(outputs[1], blocks[1], atol=1e-6)
+    # Entering: starts on the live block, ends on the previous one.
+    assert abs(outputs[2][0] - blocks[2][0]) < 1e-3
+    assert abs(outputs[2][-1] - blocks[1][-1]) < 1e-3
+    # Enhanced and delayed by one block while enabled.
+    np.testing.assert_allclose(outputs[5], 0.5 * blocks[4], atol=1e-6)
+    # Leaving: starts on the delayed enhanced block, ends on the live one.
+    assert abs(outputs[7][0] - 0.5 * blocks[6][0]) < 1e-3
+    assert abs(outputs[7][-1] - blocks[7][-1]) < 1e-3
+    np.testing.assert_allclose(outputs[8], blocks[8], atol=1e-6)
+    assert not daemon.delay_active
+
+def test_capture_uses_the_worker_for_neural_stages():
+    daemon = HearingAidDaemon(blocksize=BLOCKSIZE, inference=EchoInference())
+    daemon.update({"deepfilternet": True})
+    audio = 0.1 * np.ones(FS // 10, dtype=np.float32)
+    processed = daemon.process_block(audio)
+    np.testing.assert_allclose(processed[-100:], 0.05, atol=1e-3)
+
+def test_worker_errors_are_reported_once():
+    size = CONTROL_BYTES + 2 * SharedRing.nbytes(2, BLOCKSIZE)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        worker = InferenceWorker(FS, BLOCKSIZE, slots=2)
+        worker.control, worker.inputs, worker.outputs = attach(shm.buf, 2, BLOCKSIZE)
+        worker.control[:] = 0
+        counter = ErrorCounter(worker.control)
+        marks = []
+
+        counter.mark("deepfilternet-error")
+        counter.mark("deepfilternet-error")
+        counter.mark("unrelated")
+        worker.report_errors(marks.append)
+        worker.report_errors(marks.append)
+        worker.restarts = 1
+        worker.report_errors(marks.append)
+        assert marks == ["deepfilternet-error", "inference-restart"]
+        del worker.control, worker.inputs, worker.outputs, counter
+    finally:
+        shm.close()
+        shm.unlink()
+
+# Stage loaders for a real spawned worker; they are pickled by reference, so
+# they live at module level.
+def halve(block, settings):
+    return 0.5 * block
+
+def load_halving_stage(fs, blocksize, recorder):
+    return halve
+
+def load_failing_stage(fs, blocksize, recorder):
+    raise RuntimeError("models missing")
+
+def wait_for(condition, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_spawned_worker_round_trip_restart_and_dry_fallback():
+    worker = InferenceWorker(FS, BLOCKSIZE, slots=2, load_stages=load_halving_stage)
+    worker.start()
+    try:
+        assert wait_for(worker.is_ready)
+        settings = {"deepfilternet": True, "voicefixer": False}
+        audio = ramp_blocks(3).ravel()
+        np.testing.assert_allclose(worker.process(audio, settings), 0.5 * audio, atol=1e-6)
+
+        daemon = HearingAidDaemon(blocksize=BLOCKSIZE, inference=worker)
+        dry = HearingAidDaemon(blocksize=BLOCKSIZE).process_block(audio)
+        daemon.update({"deepfilternet": True})
+        seq = worker.submit(audio[:BLOCKSIZE], settings)
+        assert seq > 0
+        generation = int(worker.control[GENERATION])
+
+        worker.worker_process.kill()
+        assert wait_for(lambda: worker.status() == "starting")
+        # While the worker is down nothing is queued and capture stays dry.
+        assert worker.submit(audio[:BLOCKSIZE], settings) == 0
+        np.testing.assert_allclose(daemon.process_block(audio), dry, atol=1e-6)
+
+        assert wait_for(worker.is_ready)
+        assert worker.restarts == 1
+        assert worker.control[GENERATION] == generation + 1
+        # A block submitted to the previous worker is never matched.
+        out = np.zeros(BLOCKSIZE, dtype=np.float32)
+        assert worker.receive(out, seq) == 0
+        np.testing.assert_allclose(worker.process(audio, settings), 0.5 * audio, atol=1e-6)
+    finally:
+        worker.stop()
+    assert worker.status() == "stopped"
+
+def test_worker_failing_before_ready_backs_off_and_gives_up():
+    worker = InferenceWorker(FS, BLOCKSIZE, slots=2, max_failures=3, backoff_seconds=0.1,
+                             load_stages=load_failing_stage)
+    worker.start()
+    try:
+        assert wait_for(lambda: worker.status() == "failed")
+        assert worker.failures == 3
+        assert worker.restarts == 2
+        assert not worker.is_ready()
+        assert worker.submit(np.zeros(BLOCKSIZE, dtype=np.float32), {"deepfilternet": True, "voicefixer": False}) == 0
+        marks = []
+        worker.report_errors(marks.append)
+        assert marks == ["inference-restart"]
+    finally:
+        worker.stop()
+
+def test_restart_delay_doubles_up_to_the_cap():
+    worker = InferenceWorker(FS, BLOCKSIZE, backoff_seconds=1.0, max_backoff_seconds=5.0)
+    delays = []
+    for failures in range(1, 6):
+        worker.failures = failures
+        delays.append(worker.restart_delay())
+    assert delays == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+def test_ring_with_read_ahead_of_write_reads_empty():
+    size = SharedRing.nbytes(2, BLOCKSIZE)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        ring = SharedRing(shm.buf, 0, 2, BLOCKSIZE)
+        ring.reset()
+        # A skip that landed after the other side reset the ring.
+        ring.skip()
+        assert ring.peek_seq() == -1
+        block = np.ones(BLOCKSIZE, dtype=np.float32)
+        assert ring.push(block, 7)
+        assert ring.peek_seq() == -1
+        assert ring.push(block, 8)
+        assert ring.peek_seq() == 8
+        del ring
+    finally:
+        shm.close()
+        shm.unlink()
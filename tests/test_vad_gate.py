@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+sf = pytest.importorskip("soundfile")
+
+from fluctus_dsp import FS
+from vad_gate import ActivityGate, cpu_saved_percent, report
+
+BLOCKSIZE = 4096
+
+def sample_times(blocks):
+    return np.arange(blocks * BLOCKSIZE) / FS
+
+def steady_noise(blocks, seed=0):
+    return 0.02 * np.random.default_rng(seed).standard_normal(blocks * BLOCKSIZE)
+
+def mains_hum(blocks):
+    t = sample_times(blocks)
+    return sum(0.1 / k * np.sin(2 * np.pi * 50 * k * t) for k in range(1, 8))
+
+def voiced_syllables(blocks):
+    # A harmonic series with a gliding pitch, switched on and off at a
+    # syllable rate, over the steady noise.
+    t = sample_times(blocks)
+    phase = 2 * np.pi * np.cumsum(150 + 40 * np.sin(2 * np.pi * 0.7 * t)) / FS
+    voice = sum(0.2 / k * np.sin(k * phase) for k in range(1, 25))
+    syllables = np.sin(2 * np.pi * 3 * t) > 0
+    return voice * syllables + steady_noise(blocks)
+
+def gate_states(audio):
+    gate = ActivityGate(FS, BLOCKSIZE)
+    states = [gate.update(audio[i:i + BLOCKSIZE].astype(np.float32))[1]
+              for i in range(0, len(audio) - BLOCKSIZE + 1, BLOCKSIZE)]
+    return gate, states
+
+@pytest.mark.parametrize("audio", [steady_noise(40), mains_hum(40) + steady_noise(40)],
+                         ids=["noise", "hum"])
+def test_steady_background_keeps_gate_closed(audio):
+    gate, states = gate_states(audio)
+    assert not any(states)
+    assert gate.skipped_percent() == 100.0
+
+def test_modulated_harmonics_open_gate():
+    gate, states = gate_states(voiced_syllables(40))
+    assert all(states[5:])
+    assert gate.skipped_percent() < 20.0
+
+def test_gate_opens_after_background():
+    audio = np.concatenate([steady_noise(20), voiced_syllables(20)])
+    _, states = gate_states(audio)
+    assert not any(states[:20])
+    assert any(states[20:25])
+
+def test_hangover_holds_gate_open():
+    gate = ActivityGate(FS, BLOCKSIZE, hangover_blocks=4)
+    decisions = iter([True, True, False, False, False, False, False, True])
+    gate.classify = lambda block: next(decisions)
+    block = np.zeros(BLOCKSIZE, dtype=np.float32)
+    states = [gate.update(block) for _ in range(8)]
+    assert [active for _, active in states] == [True, True, True, True, True, False, False, True]
+    assert [was for was, _ in states] == [False, True, True, True, True, True, False, False]
+    assert gate.blocks_skipped == 1
+
+@pytest.mark.parametrize("n", [BLOCKSIZE, BLOCKSIZE // 4, 7])
+def test_crossfade_reaches_the_end_of_any_block(n):
+    gate = ActivityGate(FS, BLOCKSIZE)
+    dry = np.zeros(n, dtype=np.float32)
+    gate.crossfade(dry, np.ones(n, dtype=np.float32), fade_in=True)
+    assert dry[0] == 0.0 and dry[-1] == 1.0
+    assert np.all(np.diff(dry) > 0)
+
+    dry = np.zeros(n, dtype=np.float32)
+    gate.crossfade(dry, np.ones(n, dtype=np.float32), fade_in=False)
+    assert dry[0] == 1.0 and dry[-1] == 0.0
+
+def test_cpu_saved_percent():
+    # 60 of 100 blocks skipped at 10 ms each, with a 0.1 ms gate on every
+    # block: 1000 ms ungated against 400 + 10 ms gated.
+    assert cpu_saved_percent(100, 60, 0.010, 0.0001) == pytest.approx(59.0)
+    assert cpu_saved_percent(100, 0, 0.010, 0.0) == 0.0
+    assert cpu_saved_percent(100, 0, 0.010, 0.001) == pytest.approx(-10.0)
+
+def test_report(tmp_path, capsys):
+    quiet = str(tmp_path / "quiet.wav")
+    talk = str(tmp_path / "talk.wav")
+    sf.write(quiet, steady_noise(20), FS, subtype="FLOAT")
+    sf.write(talk, voiced_syllables(10)[:-100], FS, subtype="FLOAT")
+
+    summary = report([quiet, talk], BLOCKSIZE, neural_cost=0.02)
+
+    assert summary["blocks"] == 20 + 9
+    assert 20 <= summary["skipped"] <= 24
+    assert summary["cpu_saved_percent"] == pytest.approx(
+        cpu_saved_percent(summary["blocks"], summary["skipped"], 0.02, summary["gate_cost"]))
+    output = capsys.readouterr().out
+    assert "quiet.wav: 20 blocks, neural stages skipped on 100.0%" in output
+    assert f"CPU saved: {summary['cpu_saved_percent']:.1f}%" in output
+
+def test_report_without_blocks(tmp_path):
+    short = str(tmp_path / "short.wav")
+    sf.write(short, steady_noise(1)[:100], FS)
+    assert report([short], BLOCKSIZE) is None
@@ -0,0 +1,169 @@
+import argparse
+import time
+
+import numpy as np
+import soundfile as sf
+
+from fluctus_dsp import FS
+
+SPEECH_BAND = (300.0, 4000.0)
+N_BANDS = 16
+
+# Cheap per-block activity detector used to skip the neural stages on
+# silence and steady background. A block counts as speech when its
+# speech-band energy is well above the tracked noise floor and its band
+# levels are changing (spectral flux in dB); a hangover keeps the gate open
+# between words.
+class ActivityGate:
+    def __init__(self, fs=FS, blocksize=4096, threshold_db=6.0, flux_threshold_db=1.5,
+                 hangover_blocks=4, floor_rise_db=0.2):
+        self.fs = fs
+        self.blocksize = blocksize
+        self.threshold_db = threshold_db
+        self.flux_threshold_db = flux_threshold_db
+        self.hangover_blocks = hangover_blocks
+        self.floor_rise_db = floor_rise_db
+
+        self.window = np.hanning(blocksize).astype(np.float32)
+        freqs = np.fft.rfftfreq(blocksize, 1.0 / fs)
+        edges = np.searchsorted(freqs, np.geomspace(SPEECH_BAND[0], SPEECH_BAND[1], N_BANDS + 1))
+        self.band_start = edges[0]
+        self.band_stop = edges[-1]
+        self.band_edges = np.unique(edges[:-1]) - edges[0]
+        # Fade ramps per block length, so a short block still ramps all the
+        # way; the full-size pair is built up front for the audio thread.
+        self.ramps = {}
+        self.ramp(blocksize)
+
+        self.reset()
+
+    def reset(self):
+        self.prev_levels = None
+        self.noise_floor_db = None
+        self.hangover = 0
+        self.active = False
+        self.blocks_total = 0
+        self.blocks_skipped = 0
+
+    def classify(self, block):
+        if len(block) == self.blocksize:
+            spectrum = np.fft.rfft(block * self.window)
+        else:
+            spectrum = np.fft.rfft(block, self.blocksize)
+        power = np.abs(spectrum[self.band_start:self.band_stop]) ** 2
+        energy_db = 10 * np.log10(np.mean(power) + 1e-12)
+        levels = 10 * np.log10(np.add.reduceat(power, self.band_edges) + 1e-12)
+
+        if self.prev_levels is None:
+            flux = 0.0
+        else:
+            flux = np.mean(np.maximum(levels - self.prev_levels, 0.0))
+        self.prev_levels = levels
+
+        # The floor follows drops immediately and rises slowly, so it settles
+        # on the background level rather than on speech.
+        if self.noise_floor_db is None or energy_db < self.noise_floor_db:
+            self.noise_floor_db = energy_db
+        else:
+            self.noise_floor_db += self.floor_rise_db
+
+        return energy_db > self.noise_floor_db + self.threshold_db and flux > self.flux_threshold_db
+
+    def update(self, block):
+        was_active = self.active
+        if self.classify(block):
+            self.hangover = self.hangover_blocks
+        elif self.hangover > 0:
+            self.hangover -= 1
+        self.active = self.hangover > 0
+
+        self.blocks_total += 1
+        if not was_active and not self.active:
+            self.blocks_skipped += 1
+        return was_active, self.active
+
+    def ramp(self, n):
+        if n not in self.ramps:
+            fade_in = np.linspace(0.0, 1.0, n, dtype=np.float32)
+            self.ramps[n] = (fade_in, fade_in[::-1].copy())
+        return self.ramps[n]
+
+    def crossfade(self, dry, wet, fade_in):
+        # Blend in place into dry: ramps towards wet when the gate opens and
+        # back to dry when it closes, so the level does not jump.
+        ramp = self.ramp(len(dry))[0 if fade_in else 1]
+        np.subtract(wet, dry, out=wet)
+        np.multiply(wet, ramp, out=wet)
+        np.add(dry, wet, out=dry)
+        return dry
+
+    def skipped_percent(self):
+        if self.blocks_total == 0:
+            return 0.0
+        return 100.0 * self.blocks_skipped / self.blocks_total
+
+def measure_neural_cost(fs, blocksize, blocks=20):
+    from fluctus_daemon import HearingAidDaemon
+
+    daemon = HearingAidDaemon(fs=fs, blocksize=blocksize)
+    daemon.load_models()
+    settings = daemon.update({"deepfilternet": True, "voicefixer": daemon.voicefixer is not None})
+    block = (0.05 * np.random.default_rng(0).standard_normal(blocksize)).astype(np.float32)
+    daemon.process_neural(block, settings)
+    start = time.perf_counter()
+    for _ in range(blocks):
+        daemon.process_neural(block, settings)
+    return (time.perf_counter() - start) / blocks
+
+def report(paths, blocksize, neural_cost=None):
+    total_blocks = 0
+    total_skipped = 0
+    gate_time = 0.0
+    for path in paths:
+        audio, fs = sf.read(path, dtype="float32", always_2d=True)
+        audio = audio[:, 0]
+        gate = ActivityGate(fs=fs, blocksize=blocksize)
+        start = time.perf_counter()
+        for i in range(0, len(audio) - blocksize + 1, blocksize):
+            gate.update(audio[i:i + blocksize])
+        gate_time += time.perf_counter() - start
+        total_blocks += gate.blocks_total
+        total_skipped += gate.blocks_skipped
+        print(f"{path}: {gate.blocks_total} blocks, neural stages skipped on {gate.skipped_percent():.1f}%")
+
+    if total_blocks == 0:
+        print("No complete blocks found")
+        return None
+    gate_cost = gate_time / total_blocks
+    print(f"Overall: neural stages skipped on {100.0 * total_skipped / total_blocks:.1f}% of "
+          f"{total_blocks} blocks, gate cost {gate_cost * 1e6:.0f} us per block")
+    summary = {"blocks": total_blocks, "skipped": total_skipped, "gate_cost": gate_cost}
+    if neural_cost is not None:
+        summary["cpu_saved_percent"] = cpu_saved_percent(total_blocks, total_skipped, neural_cost, gate_cost)
+        print(f"Neural stages cost {neural_cost * 1e3:.1f} ms per block; "
+              f"CPU saved: {summary['cpu_saved_percent']:.1f}%")
+    return summary
+
+# Share of the neural CPU time saved by gating, net of running the gate on
+# every block.
+def cpu_saved_percent(blocks, skipped, neural_cost, gate_cost):
+    ungated = blocks * neural_cost
+    gated = (blocks - skipped) * neural_cost + blocks * gate_cost
+    return 100.0 * (ungated - gated) / ungated
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how often the activity gate skips the neural stages")
+    parser.add_argument("files", nargs="+", help="Recorded day-in-the-life WAV files")
+    parser.add_argument("--blocksize", type=int, default=4096)
+    parser.add_argument("--measure-neural", action="store_true",
+                        help="Load the models and time the neural stages to estimate CPU saved")
+    args = parser.parse_args()
+
+    neural_cost = None
+    if args.measure_neural:
+        fs = sf.info(args.files[0]).samplerate
+        neural_cost = measure_neural_cost(fs, args.blocksize)
+    report(args.files, args.blocksize, neural_cost)
+
+if __name__ == "__main__":
+    main()